@@ -1,14 +1,207 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.db import IntegrityError, connections, transaction
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 # Register your models here.
 
-from .models import Room, Topic, Message, Profile, Attendance, Tournament, LeadershipHours, PracticalScore
+from .models import Room, Topic, Message, Profile, Attendance, Tournament, LeadershipHours, PracticalScore, ProgressPeriod, ProgressSummary, \
+    ActivityEvent, getPeriod, getPeriodFilter, getQuarterRange
 
-admin.site.register(Profile)
+
+class RedateForm(forms.Form):
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+
+
+class ReassignForm(forms.Form):
+    username = forms.CharField(help_text='Username of the student the records move to.')
+
+    def clean_username(self):
+        try:
+            return Profile.objects.select_related('user').get(user__username=self.cleaned_data['username'])
+        except Profile.DoesNotExist:
+            raise forms.ValidationError('No student with that username.')
+
+
+class PeriodListFilter(admin.SimpleListFilter):
+    """Progress periods, filtered as a date range the (profile, date) indexes can serve."""
+    title = 'progress period'
+    parameter_name = 'period'
+
+    def lookups(self, request, model_admin):
+        periods = {period.start: period.name for period in ProgressPeriod.objects.all()}
+        today = timezone.localdate()
+        year, quarter = today.year, (today.month - 1) // 3 + 1
+        for _ in range(8):
+            start, end = getQuarterRange(year, quarter)
+            periods.setdefault(start, f'Q{quarter} {year}')
+            year, quarter = (year, quarter - 1) if quarter > 1 else (year - 1, 4)
+        return [(start.isoformat(), name) for start, name in sorted(periods.items(), reverse=True)]
+
+    def queryset(self, request, queryset):
+        start = parse_date(self.value()) if self.value() else None
+        if start is None:
+            return queryset
+        period = getPeriod(start)
+        return queryset.filter(**getPeriodFilter(period.start, period.end))
+
+
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ['name', 'user', 'rank', 'last_promoted']
+    list_select_related = ['user']
+    list_filter = ['rank']
+    search_fields = ['name', 'user__username']
+    raw_id_fields = ['user']
+
+    def get_queryset(self, request):
+        # the stat admins' autocomplete lists profiles by their username
+        return super().get_queryset(request).select_related('user')
+
+
+class StatAdmin(admin.ModelAdmin):
+    """
+    Change lists for the stat models. Rows come with their profile in the
+    same query, the profile is picked by autocomplete instead of a dropdown of
+    every student, and the bulk actions below are single UPDATE or DELETE
+    statements followed by a refresh of the touched progress summaries.
+    """
+    list_display = ['__str__', 'profile_name', 'date']
+    list_select_related = ['profile__user']
+    list_filter = [PeriodListFilter]
+    date_hierarchy = 'date'
+    autocomplete_fields = ['profile']
+    search_fields = ['profile__name', 'profile__user__username']
+    ordering = ['-date', '-id']
+    # the full-table COUNT(*) next to filtered results is slow on big tables
+    show_full_result_count = False
+    actions = ['redate_records', 'reassign_records', 'delete_records']
+
+    @admin.display(description='Student', ordering='profile__name')
+    def profile_name(self, obj):
+        return obj.profile.name if obj.profile else None
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # delete_selected loads and deletes the rows one at a time
+        actions.pop('delete_selected', None)
+        return actions
+
+    def bulk_action(self, request, queryset, form_class, title, apply, moved=None):
+        """
+        Show `form_class` for the selected records and, once submitted, run
+        apply(queryset, cleaned_data) as one statement. `moved` maps a
+        record's (profile_id, date) to where the change put it, so the
+        summaries of both periods are refreshed.
+        """
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            records = list(queryset.values_list('profile_id', 'date'))
+            if moved is not None:
+                records += [moved(form.cleaned_data, profile_id, date) for profile_id, date in records]
+            try:
+                with transaction.atomic():
+                    count = apply(queryset, form.cleaned_data)
+                    ProgressSummary.refresh_dates(set(records))
+            except IntegrityError:
+                self.message_user(request, 'No records were changed: a student would have two attendances '
+                                           'on the same day.', messages.ERROR)
+                return None
+            self.message_user(request, f'{count} {queryset.model._meta.verbose_name_plural} changed.',
+                              messages.SUCCESS)
+            return None
+
+        return TemplateResponse(request, 'admin/base/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            'form': form,
+            'count': queryset.count(),
+            'action': request.POST.get('action'),
+            'select_across': request.POST.get('select_across'),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Move selected records to another date')
+    def redate_records(self, request, queryset):
+        return self.bulk_action(request, queryset, RedateForm, 'Move records to another date',
+                                lambda records, data: records.update(date=data['date'], updated_at=timezone.now()),
+                                lambda data, profile_id, date: (profile_id, data['date']))
+
+    @admin.action(description='Reassign selected records to another student')
+    def reassign_records(self, request, queryset):
+        def reassign(records, data):
+            user = data['username'].user
+            # before the update, which can change what the queryset selects
+            ActivityEvent.for_records(records).update(actor=user, actor_username=user.username)
+            return records.update(profile=data['username'], updated_at=timezone.now())
+
+        return self.bulk_action(request, queryset, ReassignForm, 'Reassign records', reassign,
+                                lambda data, profile_id, date: (data['username'].id, date))
+
+    @admin.action(description='Delete selected records in one statement')
+    def delete_records(self, request, queryset):
+        # the summary refresh and the activity delete stand in for the
+        # post_delete signals, so the rows are removed without Django
+        # collecting them one by one
+        def delete(records, data):
+            ActivityEvent.for_records(records).delete()
+            if records.model._meta.related_objects:
+                # other rows point at the records, so let Django cascade
+                return records.delete()[0]
+
+            connection = connections[records.db]
+            ids, params = records.order_by().values('pk').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(records.model._meta.db_table)} '
+                               f'WHERE id IN ({ids})', params)
+                return cursor.rowcount
+
+        return self.bulk_action(request, queryset, forms.Form, 'Delete records', delete)
+
+
+class AttendanceAdmin(StatAdmin):
+    pass
+
+
+class TournamentAdmin(StatAdmin):
+    list_display = StatAdmin.list_display + ['event']
+
+
+class LeadershipHoursAdmin(StatAdmin):
+    list_display = StatAdmin.list_display + ['event', 'hours']
+
+
+class PracticalScoreAdmin(StatAdmin):
+    list_display = StatAdmin.list_display + ['score']
+
+
+class ProgressSummaryAdmin(admin.ModelAdmin):
+    list_display = ['profile', 'start', 'end', *ProgressSummary.METRICS]
+    list_select_related = ['profile__user']
+    raw_id_fields = ['profile']
+    date_hierarchy = 'start'
+
+
+class ActivityEventAdmin(admin.ModelAdmin):
+    list_display = ['actor_username', 'kind', 'summary', 'room_name', 'created']
+    list_filter = ['kind']
+    raw_id_fields = ['actor', 'message', 'room']
+    date_hierarchy = 'created'
+    show_full_result_count = False
+
+
+admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Room)
 admin.site.register(Topic)
 admin.site.register(Message)
-admin.site.register(Attendance)
-admin.site.register(Tournament)
-admin.site.register(LeadershipHours)
-admin.site.register(PracticalScore)
\ No newline at end of file
+admin.site.register(Attendance, AttendanceAdmin)
+admin.site.register(Tournament, TournamentAdmin)
+admin.site.register(LeadershipHours, LeadershipHoursAdmin)
+admin.site.register(PracticalScore, PracticalScoreAdmin)
+admin.site.register(ProgressSummary, ProgressSummaryAdmin)
+admin.site.register(ProgressPeriod)
+admin.site.register(ActivityEvent, ActivityEventAdmin)
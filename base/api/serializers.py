@@ -1,7 +1,58 @@
-from rest_framework.serializers import ModelSerializer
-from base.models import Room
+from rest_framework.serializers import CharField, DateField, IntegerField, ListField, ModelSerializer, Serializer
+from base.models import Room, Profile, Attendance, Tournament, LeadershipHours, PracticalScore
+
+class SparseFieldsSerializer(ModelSerializer):
+    """Drop every field not named in the request's ?fields=a,b,c."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        fields = request.query_params.get('fields') if request else None
+        if fields:
+            for name in set(self.fields) - set(fields.split(',')):
+                self.fields.pop(name)
 
 class RoomSerializer(ModelSerializer):
     class Meta:
         model = Room
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['search_vector']
+
+class ProfileSerializer(SparseFieldsSerializer):
+    username = CharField(source='user.username', read_only=True)
+    # annotated by ProfileQuerySet.with_progress
+    attendance_count = IntegerField(read_only=True)
+    tournament_count = IntegerField(read_only=True)
+    leadership_hours_total = IntegerField(read_only=True)
+    practical_score_latest = IntegerField(read_only=True)
+
+    class Meta:
+        model = Profile
+        fields = ['id', 'username', 'name', 'rank', 'last_promoted', 'about', 'picture',
+                  'attendance_count', 'tournament_count', 'leadership_hours_total', 'practical_score_latest']
+
+class StatSerializer(SparseFieldsSerializer):
+    username = CharField(source='profile.user.username', read_only=True, default=None)
+
+class AttendanceSerializer(StatSerializer):
+    class Meta:
+        model = Attendance
+        fields = ['id', 'profile', 'username', 'date']
+
+class TournamentSerializer(StatSerializer):
+    class Meta:
+        model = Tournament
+        fields = ['id', 'profile', 'username', 'date', 'event']
+
+class LeadershipHoursSerializer(StatSerializer):
+    class Meta:
+        model = LeadershipHours
+        fields = ['id', 'profile', 'username', 'date', 'event', 'hours']
+
+class PracticalScoreSerializer(StatSerializer):
+    class Meta:
+        model = PracticalScore
+        fields = ['id', 'profile', 'username', 'date', 'score']
+
+class BulkAttendanceSerializer(Serializer):
+    date = DateField()
+    profiles = ListField(child=IntegerField(), allow_empty=False)
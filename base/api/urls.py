@@ -5,4 +5,11 @@ urlpatterns = [
     path('', views.getRoutes),
     path('rooms/', views.getRooms),
     path('rooms/<str:pk>/', views.getRoom),
+    path('profiles/', views.getProfiles),
+    path('profiles/<str:pk>/', views.getProfile),
+    path('attendances/', views.getAttendances),
+    path('attendances/bulk/', views.bulkAttendance),
+    path('tournaments/', views.getTournaments),
+    path('leadership-hours/', views.getLeadershipHours),
+    path('practical-scores/', views.getPracticalScores),
 ]
@@ -1,7 +1,118 @@
-from rest_framework.decorators import api_view
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Prefetch, Sum
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import BasePermission, IsAuthenticated
 from rest_framework.response import Response
-from base.models import Room
-from .serializers import RoomSerializer
+from base.models import Attendance, Tournament, LeadershipHours, PracticalScore, Profile, Room, \
+    getCurrentPeriod, getPeriod, getPeriodFilter
+from .serializers import BulkAttendanceSerializer, RoomSerializer, ProfileSerializer, AttendanceSerializer, \
+    TournamentSerializer, LeadershipHoursSerializer, PracticalScoreSerializer
+
+
+class IsSuperuser(BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_superuser
+
+
+class RecordPagination(CursorPagination):
+    # cursors seek on the ordering instead of counting an OFFSET, so a page
+    # deep into the table costs the same as the first one
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-date', '-id')
+
+
+class ProfilePagination(RecordPagination):
+    ordering = 'id'
+
+
+class RoomPagination(RecordPagination):
+    ordering = ('-updated', '-id')
+
+
+def getRoomsVersion(request):
+    """
+    The newest Room.updated and last_activity plus the room and message
+    counts, which also change on deletes and posts that leave `updated`
+    alone, and the newest id and row count of the participants join table,
+    which change on every join and leave wherever it happens. Computed once
+    per request for both the ETag and Last-Modified.
+    """
+    if not hasattr(request, 'rooms_version'):
+        request.rooms_version = {
+            **Room.objects.aggregate(updated=Max('updated'), activity=Max('last_activity'), rooms=Count('id'),
+                                     messages=Sum('message_count')),
+            **Room.participants.through.objects.aggregate(joined=Max('id'), participants=Count('id')),
+        }
+    return request.rooms_version
+
+
+def getRoomsEtag(request):
+    version = getRoomsVersion(request)
+    if version['updated'] is None:
+        return None
+    activity = version['activity'].timestamp() if version['activity'] else 0
+    return f'{version["updated"].timestamp()}-{activity}-{version["rooms"]}-{version["joined"]}-' \
+           f'{version["participants"]}-{version["messages"]}'
+
+
+def getRoomsLastModified(request):
+    version = getRoomsVersion(request)
+    return max(filter(None, [version['updated'], version['activity']]), default=None)
+
+
+def getDateParam(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({name: ['Enter a date as YYYY-MM-DD.']})
+    return date
+
+
+def getPeriodParam(request):
+    """The period ?period=current or ?period=<date> falls in, or None."""
+    if request.query_params.get('period') == 'current':
+        return getCurrentPeriod()
+    date = getDateParam(request, 'period')
+    return getPeriod(date) if date else None
+
+
+def listRecords(request, model, serializer_class):
+    """
+    One page of a stat model, filtered by ?profile=, ?period= or a
+    ?start=&end= date range (end excluded like the period ranges).
+    """
+    records = model.objects.select_related('profile__user')
+
+    if request.query_params.get('profile'):
+        try:
+            records = records.filter(profile_id=int(request.query_params['profile']))
+        except ValueError:
+            raise ValidationError({'profile': ['Enter a profile id.']})
+
+    period = getPeriodParam(request)
+    if period:
+        records = records.filter(**getPeriodFilter(period.start, period.end))
+    start, end = getDateParam(request, 'start'), getDateParam(request, 'end')
+    if start:
+        records = records.filter(date__gte=start)
+    if end:
+        records = records.filter(date__lt=end)
+
+    paginator = RecordPagination()
+    page = paginator.paginate_queryset(records, request)
+    serializer = serializer_class(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -10,15 +121,28 @@ def getRoutes(request):
         'GET /api',
         'GET /api/rooms',
         'GET /api/rooms/:id',
+        'GET /api/profiles',
+        'GET /api/profiles/:id',
+        'GET /api/attendances',
+        'GET /api/tournaments',
+        'GET /api/leadership-hours',
+        'GET /api/practical-scores',
+        'POST /api/attendances/bulk',
     ]
     return Response(routes)
 
 
+@condition(etag_func=getRoomsEtag, last_modified_func=getRoomsLastModified)
 @api_view(['GET'])
 def getRooms(request):
-    rooms = Room.objects.all()
-    serializer = RoomSerializer(rooms, many=True)
-    return Response(serializer.data)
+    # host and topic serialize as ids straight off the row; only the
+    # participant ids need a second query, shared by the whole page
+    rooms = Room.objects.prefetch_related(Prefetch('participants', queryset=User.objects.only('id')))
+
+    paginator = RoomPagination()
+    page = paginator.paginate_queryset(rooms, request)
+    serializer = RoomSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -26,3 +150,72 @@ def getRoom(request, pk):
     room = Room.objects.get(id=pk)
     serializer = RoomSerializer(room, many=False)
     return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getProfiles(request):
+    period = getPeriodParam(request) or getCurrentPeriod()
+    profiles = Profile.objects.select_related('user').with_progress(period)
+
+    paginator = ProfilePagination()
+    page = paginator.paginate_queryset(profiles, request)
+    serializer = ProfileSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getProfile(request, pk):
+    period = getPeriodParam(request) or getCurrentPeriod()
+    profile = Profile.objects.select_related('user').with_progress(period).get(id=pk)
+    serializer = ProfileSerializer(profile, many=False, context={'request': request})
+    return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getAttendances(request):
+    return listRecords(request, Attendance, AttendanceSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getTournaments(request):
+    return listRecords(request, Tournament, TournamentSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getLeadershipHours(request):
+    return listRecords(request, LeadershipHours, LeadershipHoursSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getPracticalScores(request):
+    return listRecords(request, PracticalScore, PracticalScoreSerializer)
+
+
+@api_view(['POST'])
+@permission_classes([IsSuperuser])
+def bulkAttendance(request):
+    serializer = BulkAttendanceSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    date = serializer.validated_data['date']
+
+    profiles = Profile.objects.filter(id__in=serializer.validated_data['profiles']).order_by('name')
+    names = dict(profiles.values_list('id', 'name'))
+    missing = set(serializer.validated_data['profiles']) - names.keys()
+    if missing:
+        return Response({'profiles': [f'Unknown profile {profile_id}.' for profile_id in sorted(missing)]},
+                        status=400)
+
+    summaries = Attendance.check_in(date, names.keys())
+    return Response({
+        'date': date,
+        'profiles': [{'id': profile_id,
+                      'name': name,
+                      'attendance_count': summaries[profile_id].attendance_count}
+                     for profile_id, name in names.items()],
+    })
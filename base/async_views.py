@@ -0,0 +1,140 @@
+import asyncio
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.shortcuts import render, resolve_url
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import Attendance, Tournament, LeadershipHours, PracticalScore, Profile
+from .search import searchActivity
+from .views import getActivityPage, getProfileConditions, getRoster
+
+# The read-only pages as async views, served instead of the ones in views.py
+# when the site runs under ASGI (settings.ASYNC_VIEWS). Django 4.0 has no
+# async ORM, so the database work runs on a pool of worker threads, and
+# queries that do not depend on each other run on separate ones at once.
+# The pool's threads keep their connections between requests, where the
+# thread Django gives each sync view under ASGI opens a new one every time.
+
+STATS_MODELS = {
+    'attendances': Attendance,
+    'tournaments': Tournament,
+    'leadership-hours': LeadershipHours,
+    'practical-scores': PracticalScore,
+}
+
+
+def runInPool(func, *args, **kwargs):
+    def run():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+async def gatherQueries(*queries):
+    """Run each callable's queries concurrently and return their results in order."""
+    return await asyncio.gather(*[runInPool(query) for query in queries])
+
+
+def loginRequired(view):
+    # login_required only wraps sync views before Django 5.0
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await runInPool(lambda: request.user.is_authenticated):
+            return redirect_to_login(request.get_full_path(), resolve_url('login'))
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def conditionalView(etag_func, last_modified_func):
+    """
+    condition() and cache_control(private=True, no_cache=True) for async
+    views, which those decorators only wrap from Django 5.0 on.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag, last_modified = await runInPool(
+                lambda: (etag_func(request, *args, **kwargs), last_modified_func(request, *args, **kwargs)))
+            etag = quote_etag(etag) if etag else None
+            last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+async def home(request):
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+
+    context = {'roster': await runInPool(getRoster, q)}
+    return await runInPool(render, request, 'base/home.html', context)
+
+
+@conditionalView(**getProfileConditions('user_id'))
+async def userProfile(request, pk):
+    user = await runInPool(User.objects.select_related('profile').get, id=pk)
+    profile = user.profile
+
+    attendances, tournaments, leadership_hours, practical_scores, profile.current_progress = await gatherQueries(
+        lambda: list(profile.get_recent_attendances()[:5]),
+        lambda: list(profile.get_recent_tournaments()[:5]),
+        lambda: list(profile.get_recent_leadership_hours()[:5]),
+        lambda: list(profile.get_recent_practical_scores()[:5]),
+        lambda: profile.current_progress,
+    )
+
+    context = {'user': user,
+               'attendances': attendances,
+               'tournaments': tournaments,
+               'leadership_hours': leadership_hours,
+               'practical_scores': practical_scores}
+
+    return await runInPool(render, request, 'base/profile.html', context)
+
+
+@loginRequired
+@conditionalView(**getProfileConditions('id'))
+async def statsPage(request, pk):
+    # the page lists one kind of record, picked by the url it is served under
+    model = STATS_MODELS[request.resolver_match.url_name]
+    profile, records = await gatherQueries(
+        lambda: Profile.objects.select_related('user').get(id=pk),
+        lambda: list(model.objects.filter(profile_id=pk)),
+    )
+
+    context = {
+        'profile': profile,
+        'attendances': records if model is Attendance else [],
+        'tournaments': records if model is Tournament else [],
+        'hours': records if model is LeadershipHours else [],
+        'scores': records if model is PracticalScore else [],
+    }
+
+    return await runInPool(render, request, 'base/stats.html', context)
+
+
+async def activityPage(request):
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+    activity_events, activity_cursor = await runInPool(
+        lambda: getActivityPage(searchActivity(q), request.GET.get('cursor')))
+
+    context = {'activity_events': activity_events, 'activity_cursor': activity_cursor, 'q': q}
+    return await runInPool(render, request, 'base/activity.html', context)
@@ -0,0 +1,97 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# rendered fragments expire on their own as well, so entries for versions
+# nobody asks for any more do not pile up in the cache
+FRAGMENT_TIMEOUT = 60 * 60
+
+ROSTER_VERSION_KEY = 'roster:version'
+GENERATION_KEY = 'roster:generation'
+
+
+def getVersionKey(profile_id):
+    return f'profile:{profile_id}:version'
+
+
+def newVersion():
+    # counters start from the clock rather than 1, so a counter the cache
+    # evicted and recreated cannot land on a version that is still cached
+    return time.time_ns() // 1000
+
+
+def incrVersion(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, newVersion(), timeout=None)
+        return cache.get(key)
+
+
+def getVersions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: newVersion() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return versions
+
+
+def bumpProfileVersions(profile_ids):
+    """
+    Invalidate the cached cards of these profiles and the cached rosters.
+    Runs once the current transaction commits, so a request racing the
+    write cannot cache the old data under the new version.
+    """
+    profile_ids = {profile_id for profile_id in profile_ids if profile_id is not None}
+    if not profile_ids:
+        return
+
+    def bump():
+        for profile_id in profile_ids:
+            incrVersion(getVersionKey(profile_id))
+        incrVersion(ROSTER_VERSION_KEY)
+    transaction.on_commit(bump)
+
+
+def invalidateRoster():
+    """Invalidate every cached card and roster, for writes that skip the signals."""
+    transaction.on_commit(lambda: incrVersion(GENERATION_KEY))
+
+
+def getRosterKey(q, period):
+    versions = getVersions([GENERATION_KEY, ROSTER_VERSION_KEY])
+    digest = hashlib.md5(q.encode()).hexdigest()
+    return f'roster:{versions[GENERATION_KEY]}:{versions[ROSTER_VERSION_KEY]}:{period.start}:{digest}'
+
+
+def getCardKeys(profile_ids, period):
+    versions = getVersions([GENERATION_KEY] + [getVersionKey(profile_id) for profile_id in profile_ids])
+    return {
+        profile_id: f'profile-card:{versions[GENERATION_KEY]}:{profile_id}:'
+                    f'{versions[getVersionKey(profile_id)]}:{period.start}'
+        for profile_id in profile_ids
+    }
+
+
+def getCachedCards(profiles, period, render):
+    """
+    Return the card html of each profile in order, reading every card that
+    is still current from the cache in one round trip and rendering the rest
+    with `render(profile)`.
+    """
+    keys = getCardKeys([profile.id for profile in profiles], period)
+    cached = cache.get_many(list(keys.values()))
+
+    cards, missing = [], {}
+    for profile in profiles:
+        key = keys[profile.id]
+        if key not in cached:
+            cached[key] = missing[key] = render(profile)
+        cards.append(cached[key])
+
+    if missing:
+        cache.set_many(missing, timeout=FRAGMENT_TIMEOUT)
+    return cards
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.template.loader import render_to_string
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Server-sent events for the room threads. RoomEvents sits in front of Django
+# in asgi.py and streams every message posted in a room, rendered once as a
+# small fragment, to everyone who has the room open. A broker hands the
+# fragments to the streams: LocalBroker for a single server process such as
+# local development, PollingBroker when posts can land in any process.
+
+EVENTS_PATH = re.compile(r'^/room/(?P<room_id>\d+)/events/$')
+
+# messages rendered per batch when a stream catches up after reconnecting
+CATCH_UP_SIZE = 100
+
+
+def renderMessageEvents(room_messages):
+    # rendered without a request so the fragment is the same for every reader;
+    # the author's own page adds the message from the POST response instead
+    return [(message.id, render_to_string('base/room_message.html', {'message': message}))
+            for message in room_messages]
+
+
+def getMessageEvents(room_id, after, exclude=()):
+    """
+    Render the messages posted in a room after message `after`, other than
+    those in `exclude`, as [(id, html)], oldest first.
+    """
+    room_messages = Message.objects.filter(room_id=room_id, id__gt=after).exclude(id__in=exclude) \
+        .select_related('user__profile').order_by('id')[:CATCH_UP_SIZE]
+    return renderMessageEvents(room_messages)
+
+
+def getNewestMessageId(room_id):
+    return Message.objects.filter(room_id=room_id).aggregate(newest=Max('id'))['newest'] or 0
+
+
+def runQuery(func, *args):
+    def run():
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+class Broker:
+    def __init__(self, options):
+        self.options = options
+        # room id -> queues of the streams open on it
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, room_id, after):
+        """
+        Return a queue that receives batches of (id, html) for each new
+        message in the room, for a stream that has read up to message `after`.
+        """
+        queue = asyncio.Queue()
+        self.subscribers[room_id].add(queue)
+        self.subscribed(room_id, after)
+        return queue
+
+    def unsubscribe(self, room_id, queue):
+        self.subscribers[room_id].discard(queue)
+        if not self.subscribers[room_id]:
+            del self.subscribers[room_id]
+
+    def subscribed(self, room_id, after):
+        pass
+
+    def deliver(self, room_id, events):
+        for queue in self.subscribers.get(room_id, ()):
+            queue.put_nowait(events)
+
+    def publish(self, room_id, message_id):
+        pass
+
+
+class LocalBroker(Broker):
+    """
+    Hand new messages straight to the streams of this process. Posts made in
+    any other process are never seen, so only use it with one server process.
+    """
+    loop = None
+
+    def subscribed(self, room_id, after):
+        self.loop = asyncio.get_running_loop()
+
+    def publish(self, room_id, message_id):
+        # called from the posting view's thread once its transaction commits
+        if self.loop is None or not self.subscribers.get(room_id):
+            return
+        events = renderMessageEvents(Message.objects.filter(id=message_id).select_related('user__profile'))
+        self.loop.call_soon_threadsafe(self.deliver, room_id, events)
+
+
+class PollingBroker(Broker):
+    """
+    Poll the messages table for each room someone has open, once per
+    POLL_INTERVAL and per process however many readers the room has, so posts
+    from any process or server reach every stream.
+
+    A message's id is taken when its post starts but the row only shows once
+    the post commits, so a lower id can appear after a higher one was
+    delivered. The ids delivered in the last REPOLL_WINDOW seconds are
+    remembered, and the poll keeps looking below them for anything new.
+
+    A poller starts after the lowest id its first subscribers have read, not
+    the newest id when it starts, so a post committing between a stream's
+    catch-up and the first poll is still delivered.
+    """
+    def __init__(self, options):
+        super().__init__(options)
+        self.interval = options.get('POLL_INTERVAL', 1.0)
+        self.window = options.get('REPOLL_WINDOW', 10.0)
+        self.pollers = {}
+        # room id -> where its poller starts, until its first poll
+        self.starts = {}
+
+    def subscribed(self, room_id, after):
+        if room_id not in self.pollers:
+            self.starts[room_id] = after
+            self.pollers[room_id] = asyncio.create_task(self.poll(room_id))
+        elif room_id in self.starts:
+            self.starts[room_id] = min(self.starts[room_id], after)
+
+    async def poll(self, room_id):
+        try:
+            after = None
+            # id -> when it was delivered, for the ids above `after`
+            delivered = {}
+            while self.subscribers.get(room_id):
+                await asyncio.sleep(self.interval)
+                if after is None:
+                    # later subscribers' catch-ups end after this poll
+                    after = self.starts.pop(room_id)
+                try:
+                    events = await runQuery(getMessageEvents, room_id, after, list(delivered))
+                except Exception:
+                    # keep the streams open through a database hiccup
+                    logger.exception('Polling room %s for new messages failed', room_id)
+                    continue
+
+                now = time.monotonic()
+                if events:
+                    delivered.update((message_id, now) for message_id, html in events)
+                    self.deliver(room_id, events)
+                # stop looking below ids delivered longer than the window ago
+                expired = [message_id for message_id, seen in delivered.items() if now - seen > self.window]
+                if expired:
+                    after = max(expired)
+                    delivered = {message_id: seen for message_id, seen in delivered.items() if message_id > after}
+        finally:
+            del self.pollers[room_id]
+            self.starts.pop(room_id, None)
+
+
+BROKERS = {
+    'local': LocalBroker,
+    'polling': PollingBroker,
+}
+
+broker = None
+
+
+def getBroker():
+    global broker
+    if broker is None:
+        options = getattr(settings, 'ROOM_EVENTS', {})
+        broker = BROKERS[options.get('BROKER', 'polling')](options)
+    return broker
+
+
+def formatEvents(events):
+    return ''.join(
+        f'id: {message_id}\nevent: message\n' + ''.join(f'data: {line}\n' for line in html.splitlines()) + '\n'
+        for message_id, html in events
+    ).encode()
+
+
+class RoomEvents:
+    """
+    ASGI middleware answering GET /room/<id>/events/ with a text/event-stream
+    of the room's new messages, and passing every other request to Django.
+    The stream starts after ?after=<id>, or after the Last-Event-ID the
+    browser sends when it reconnects.
+    """
+    def __init__(self, app):
+        self.app = app
+        options = getattr(settings, 'ROOM_EVENTS', {})
+        self.keepalive = options.get('KEEPALIVE', 15)
+
+    async def __call__(self, scope, receive, send):
+        match = EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None or scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        query = parse_qs(scope['query_string'].decode())
+        after = headers.get(b'last-event-id', b'').decode() or query.get('after', [''])[0]
+        after = int(after) if after.isdigit() else await runQuery(getNewestMessageId, int(match['room_id']))
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                # stop proxies such as nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        stream = asyncio.create_task(self.stream(int(match['room_id']), after, send))
+        disconnected = asyncio.create_task(self.disconnected(receive))
+        await asyncio.wait([stream, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        for task in (stream, disconnected):
+            task.cancel()
+        if stream.done() and not stream.cancelled() and stream.exception():
+            logger.error('Room %s event stream failed', match['room_id'], exc_info=stream.exception())
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+
+    async def stream(self, room_id, after, send):
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        broker = getBroker()
+        queue = broker.subscribe(room_id, after)
+        # the ids the catch-up sent, which the broker may hand over again
+        sent = set()
+        start = after
+        try:
+            # whatever was posted while the reader was away or reconnecting
+            while missed := await runQuery(getMessageEvents, room_id, after):
+                after = missed[-1][0]
+                sent.update(message_id for message_id, html in missed)
+                await send({'type': 'http.response.body', 'body': formatEvents(missed), 'more_body': True})
+
+            while True:
+                try:
+                    batch = await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    # a comment line keeps idle connections from being dropped
+                    body = b': keepalive\n\n'
+                else:
+                    # skip what the catch-up already sent and what the reader
+                    # had before; lower ids than the last one sent can still
+                    # be new when they commit late
+                    batch = [(message_id, html) for message_id, html in batch
+                             if message_id > start and message_id not in sent]
+                    if not batch:
+                        continue
+                    body = formatEvents(batch)
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            broker.unsubscribe(room_id, queue)
+
+    async def disconnected(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,71 @@
+import csv
+import json
+
+from .models import Attendance, Tournament, LeadershipHours, PracticalScore, getPeriodFilter
+
+EXPORT_CHUNK_SIZE = 2000
+
+# the same record type names and columns import_progress reads, so an export
+# can be loaded back in as is
+EXPORT_MODELS = {
+    'attendance': Attendance,
+    'tournament': Tournament,
+    'leadership_hours': LeadershipHours,
+    'practical_score': PracticalScore,
+}
+
+EXPORT_COLUMNS = ['type', 'username', 'name', 'date', 'event', 'hours', 'score']
+
+
+class Echo:
+    """A file-like object that hands back what is written instead of buffering it."""
+    def write(self, value):
+        return value
+
+
+def getExportRecords(profile=None, period=None, types=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield one dict per record of one profile, or of every profile, optionally
+    limited to a period. Each model is read through a chunked iterator (a
+    server-side cursor on Postgres) so memory stays flat however large the
+    academy is.
+    """
+    for record_type, model in EXPORT_MODELS.items():
+        if types and record_type not in types:
+            continue
+
+        records = model.objects.select_related('profile__user').order_by('pk')
+        if profile is not None:
+            records = records.filter(profile=profile)
+        if period is not None:
+            records = records.filter(**getPeriodFilter(period.start, period.end))
+
+        for record in records.iterator(chunk_size=chunk_size):
+            row = {
+                'type': record_type,
+                'username': record.profile.user.username if record.profile else None,
+                'name': record.profile.name if record.profile else None,
+                'date': record.date.isoformat(),
+            }
+            for field in ('event', 'hours', 'score'):
+                if hasattr(record, field):
+                    row[field] = getattr(record, field)
+            yield row
+
+
+def streamCsv(records):
+    writer = csv.DictWriter(Echo(), fieldnames=EXPORT_COLUMNS)
+    yield writer.writeheader()
+    for row in records:
+        yield writer.writerow(row)
+
+
+def streamJsonl(records):
+    for row in records:
+        yield json.dumps(row) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (streamCsv, 'text/csv'),
+    'jsonl': (streamJsonl, 'application/x-ndjson'),
+}
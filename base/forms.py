@@ -57,4 +57,11 @@ class PracticalScoreForm(ModelForm):
         fields = ['date', 'score']
         widgets = {
             'date': DateInput(attrs=dict(max = timezone.localdate)),
-        }
\ No newline at end of file
+        }
+
+class BulkAttendanceForm(forms.Form):
+    date = forms.DateField(initial=timezone.localdate, widget=DateInput(attrs=dict(max = timezone.localdate)))
+    profiles = forms.ModelMultipleChoiceField(
+        queryset=Profile.objects.select_related('user').order_by('name'),
+        widget=forms.CheckboxSelectMultiple,
+    )
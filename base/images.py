@@ -0,0 +1,92 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .caching import bumpProfileVersions
+
+logger = logging.getLogger(__name__)
+
+# longest side in pixels; small covers the feed avatars at 2x, medium the
+# profile page
+PICTURE_SIZES = {
+    'small': 128,
+    'medium': 300,
+}
+
+PICTURE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# resizing is CPU bound but Pillow releases the GIL while encoding, so a
+# couple of threads keep uploads off the request path without a broker
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pictures')
+
+
+def needsVariants(profile):
+    return not profile.picture.name.endswith('.svg') and \
+        profile.picture_variants.get('source') != profile.picture.name
+
+
+def getVariantName(source, size, fmt):
+    root, _ = os.path.splitext(source)
+    return f'{root}-{size}.{fmt}'
+
+
+def buildVariants(picture):
+    """
+    Write every size and format of `picture` next to the original and return
+    the variants mapping stored on Profile.picture_variants.
+    """
+    storage = picture.storage
+    with storage.open(picture.name, 'rb') as f:
+        img = ImageOps.exif_transpose(Image.open(f))
+        img.load()
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    variants = {'source': picture.name}
+    for size, pixels in PICTURE_SIZES.items():
+        thumbnail = img.copy()
+        thumbnail.thumbnail((pixels, pixels))
+
+        variants[size] = {}
+        for fmt, (pil_format, options) in PICTURE_FORMATS.items():
+            buffer = BytesIO()
+            thumbnail.save(buffer, pil_format, **options)
+            name = getVariantName(picture.name, size, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            variants[size][fmt] = storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def processPicture(profile_id):
+    """Generate the picture variants of one profile. Runs on the pool."""
+    from .models import Profile
+
+    try:
+        profile = Profile.objects.get(pk=profile_id)
+        if not needsVariants(profile):
+            return
+        variants = buildVariants(profile.picture)
+        # skip the write if another upload replaced the picture meanwhile
+        if Profile.objects.filter(pk=profile_id, picture=variants['source']).update(picture_variants=variants,
+                                                                                   last_changed=timezone.now()):
+            bumpProfileVersions([profile_id])
+    except Exception:
+        logger.exception('Could not process the picture of profile %s', profile_id)
+    finally:
+        close_old_connections()
+
+
+def schedulePicture(profile):
+    """Process the profile picture in the background once the upload commits."""
+    if needsVariants(profile):
+        transaction.on_commit(lambda: executor.submit(processPicture, profile.pk))
@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from base.models import Message, Profile, Room, Topic
+from base.search import SEARCH_VECTORS, searchMessages, searchProfiles, searchRooms, updateSearchVector
+
+WORDS = ('dragon tiger crane form sparring kata board breaking tournament black belt red brown '
+         'testing cycle leadership class practice weapons staff nunchaku self defense kicks '
+         'stretching conditioning review forms judging demo team seminar camp').split()
+
+
+class Rollback(Exception):
+    pass
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def current_filters(q):
+    """The icontains filters the views used before the search module."""
+    return {
+        'rooms': Room.objects.filter(
+            Q(topic__name__icontains=q) |
+            Q(name__icontains=q) |
+            Q(description__icontains=q) |
+            Q(host__username__icontains=q)
+        ),
+        'messages': Message.objects.filter(
+            Q(room__topic__name__icontains=q) |
+            Q(room__name__icontains=q) |
+            Q(room__description__icontains=q)
+        ),
+        'profiles': Profile.objects.filter(
+            Q(user__username__icontains=q) |
+            Q(name__icontains=q)
+        ).order_by('name'),
+    }
+
+
+def search_filters(q):
+    return {
+        'rooms': searchRooms(q),
+        'messages': searchMessages(q),
+        'profiles': searchProfiles(q),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Compare the search module against the old icontains filters on synthetic data. '
+            'Everything is generated inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Messages to generate.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.generate(options['rows'], random.Random(options['seed']))
+                self.compare(options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def generate(self, rows, rng):
+        users = max(rows // 50, 10)
+        rooms = max(rows // 20, 10)
+        self.stdout.write(f'Generating {users} students, {rooms} rooms and {rows} messages...')
+
+        topics = Topic.objects.bulk_create([Topic(name=word.title()) for word in WORDS])
+        User.objects.bulk_create([User(username=f'bench_{i}') for i in range(users)], batch_size=2000)
+        user_list = list(User.objects.filter(username__startswith='bench_'))
+        Profile.objects.bulk_create(
+            [Profile(user=user, name=sentence(rng, 2).title(), about=sentence(rng, 12)) for user in user_list],
+            batch_size=2000
+        )
+        room_list = Room.objects.bulk_create(
+            [Room(host=rng.choice(user_list), topic=rng.choice(topics), name=sentence(rng, 3),
+                  description=sentence(rng, 20)) for _ in range(rooms)],
+            batch_size=2000
+        )
+        Message.objects.bulk_create(
+            [Message(user=rng.choice(user_list), room=rng.choice(room_list), body=sentence(rng, 15))
+             for _ in range(rows)],
+            batch_size=2000
+        )
+
+        # the GIN indexes themselves are created by migrate
+        for model in SEARCH_VECTORS:
+            updateSearchVector(model)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def compare(self, repeat):
+        for q in ['nunchaku', 'seminar camp', 'bench_12']:
+            for (name, old), new in zip(current_filters(q).items(), search_filters(q).values()):
+                old_ms, old_count = self.time(old, repeat)
+                new_ms, new_count = self.time(new, repeat)
+                self.stdout.write(f'{name:<9} q={q!r:<15} icontains {old_ms:8.1f} ms ({old_count} rows)   '
+                                  f'search {new_ms:8.1f} ms ({new_count} rows)')
+
+    def time(self, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset[:50])
+            count = queryset.count()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), count
@@ -0,0 +1,151 @@
+import json
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from base.models import Profile, Attendance, Room
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Measure the latency and query count of the main pages and the rooms API against the current '
+            'database (see generate_academy), write the results as JSON and compare them with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help='Warm runs per page.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare against the results of an earlier run.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed slowdown of the median before a page counts as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--username', help='User to browse as. Defaults to a superuser.')
+
+    def handle(self, *args, **options):
+        user = self.getUser(options['username'])
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        client.force_login(user)
+
+        results = {}
+        for name, url in self.getTargets():
+            results[name] = self.measure(client, url, options['repeat'])
+            result = results[name]
+            self.stdout.write(f'{name:<16} {result["median_ms"]:>9.1f} ms  p95 {result["p95_ms"]:>8.1f} ms  '
+                              f'cold {result["cold_ms"]:>8.1f} ms  {result["queries"]:>4} queries')
+
+        report = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'profiles': Profile.objects.count(),
+                'attendances': Attendance.objects.count(),
+                'rooms': Room.objects.count(),
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}.')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline['results'], results, options['tolerance'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} pages regressed: {", ".join(regressions)}')
+
+    def getUser(self, username):
+        users = User.objects.filter(username=username) if username else \
+            User.objects.filter(is_superuser=True).order_by('id')
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to browse as. Run generate_academy or pass --username.')
+        return user
+
+    def getTargets(self):
+        # the busiest student and room, so the numbers reflect the worst pages
+        profile = Profile.objects.annotate(records=Count('attendance')).order_by('-records', 'id').first()
+        room = Room.objects.annotate(messages=Count('message')).order_by('-messages', 'id').first()
+        if profile is None or room is None:
+            raise CommandError('The database has no profiles or rooms. Run generate_academy first.')
+
+        return [
+            ('home', '/'),
+            ('userProfile', f'/profile/{profile.user_id}'),
+            ('statsPage', f'/profile/{profile.id}/attendances/'),
+            ('rooms', '/rooms/'),
+            ('room', f'/room/{room.id}'),
+            ('activityPage', '/activity/'),
+            ('topicsPage', '/topics/'),
+            ('api-rooms', '/api/rooms/'),
+            ('api-room', f'/api/rooms/{room.id}/'),
+        ]
+
+    def measure(self, client, url, repeat):
+        cache.clear()
+        cold, cold_queries, status = self.fetch(client, url)
+        timings, queries = [], 0
+        for _ in range(repeat):
+            elapsed, queries, status = self.fetch(client, url)
+            timings.append(elapsed)
+
+        return {
+            'url': url,
+            'status': status,
+            'cold_ms': round(cold, 2),
+            'cold_queries': cold_queries,
+            'median_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': queries,
+        }
+
+    def fetch(self, client, url):
+        # the capture log is capped, so start every request with an empty one
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise CommandError(f'{url} answered {response.status_code}.')
+        return elapsed, len(queries), response.status_code
+
+    def compare(self, baseline, results, tolerance):
+        regressions = []
+        self.stdout.write('\nAgainst the baseline:')
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name:<16} new')
+                continue
+
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+            # ignore sub-millisecond noise on the fastest pages
+            slower = change > tolerance and result['median_ms'] - before['median_ms'] > 1
+            more_queries = result['queries'] > before['queries']
+            line = (f'{name:<16} {before["median_ms"]:>9.1f} -> {result["median_ms"]:>9.1f} ms ({change:+.0%})  '
+                    f'{before["queries"]:>4} -> {result["queries"]:>4} queries')
+            if slower or more_queries:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        return regressions
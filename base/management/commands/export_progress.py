@@ -0,0 +1,56 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from base.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_MODELS, getExportRecords
+from base.models import Profile, getCurrentPeriod, getPeriod
+
+
+class Command(BaseCommand):
+    help = ('Stream attendance, tournament, leadership hours and practical score records as CSV or JSONL, '
+            'for one profile or the whole academy. The output can be read back by import_progress.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write. Defaults to stdout.')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--username', help='Only export this user\'s records.')
+        parser.add_argument('--period', help='"current" or a date inside the period to export.')
+        parser.add_argument('--type', choices=sorted(EXPORT_MODELS), action='append',
+                            help='Record type to export. May be repeated; defaults to all.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        profile = None
+        if options['username']:
+            try:
+                profile = Profile.objects.get(user__username=options['username'])
+            except Profile.DoesNotExist:
+                raise CommandError(f'No profile for username {options["username"]!r}.')
+
+        period = None
+        if options['period'] == 'current':
+            period = getCurrentPeriod()
+        elif options['period']:
+            date = parse_date(options['period'])
+            if date is None:
+                raise CommandError('--period must be "current" or a date (YYYY-MM-DD).')
+            period = getPeriod(date)
+
+        stream, _ = EXPORT_FORMATS[options['format']]
+        records = getExportRecords(profile, period, options['type'], options['chunk_size'])
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        count = 0
+        try:
+            for chunk in stream(records):
+                out.write(chunk)
+                count += 1
+        finally:
+            if options['output']:
+                out.close()
+
+        if options['output']:
+            # the csv stream yields its header line first
+            rows = count - 1 if options['format'] == 'csv' else count
+            self.stdout.write(self.style.SUCCESS(f'Exported {rows} records to {options["output"]}.'))
@@ -0,0 +1,190 @@
+import datetime
+import random
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from base.caching import bumpProfileVersions
+from base.models import Profile, Attendance, Tournament, LeadershipHours, PracticalScore, Topic, Room, Message, \
+    touchProfiles
+from base.search import updateSearchVector
+
+TOPICS = ['Forms', 'Sparring', 'Board Breaking', 'Weapons', 'Self Defense', 'Tournaments', 'Testing',
+          'Leadership', 'Conditioning', 'Demo Team', 'Seminars', 'Summer Camp']
+
+EVENTS = ['Spring Open', 'Summer Classic', 'Fall Invitational', 'Winter Cup', 'State Championship',
+          'Regional Qualifier', 'Nationals']
+
+LEADERSHIP_EVENTS = ['Little Dragons class', 'Beginner class', 'Testing judge', 'Demo team practice',
+                     'Summer camp', 'Tournament ring']
+
+WORDS = ('dragon tiger crane form sparring kata board breaking tournament black belt red brown '
+         'testing cycle leadership class practice weapons staff nunchaku self defense kicks '
+         'stretching conditioning review forms judging demo team seminar camp').split()
+
+# roughly how an academy's advanced students spread over the ranks
+RANK_WEIGHTS = [30, 20, 18, 12, 10, 5, 3, 1.5, 0.5]
+
+BATCH_SIZE = 10000
+
+
+def batched(records, size=BATCH_SIZE):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a synthetic academy for benchmarking: students with years of attendance, '
+            'tournaments, leadership hours and practical scores, plus rooms and messages. Generated users are '
+            'named PREFIX<n>, and PREFIXadmin is a superuser that benchmark_views logs in as.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=2000)
+        parser.add_argument('--years', type=int, default=3)
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='academy_')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the users generated by an earlier run first.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.today = datetime.date.today()
+        self.first_day = self.today - datetime.timedelta(days=365 * options['years'])
+        prefix = options['prefix']
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+            Topic.objects.filter(name__in=TOPICS, room__isnull=True).delete()
+            self.stdout.write(f'Deleted {deleted} rows from the previous run.')
+        elif User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}<n> already exist from an earlier run. Pass --clear to replace '
+                               f'them, or choose another --prefix.')
+
+        with transaction.atomic():
+            profiles = self.createProfiles(prefix, options['profiles'])
+            for model, records in [(Attendance, self.attendances(profiles)),
+                                   (Tournament, self.tournaments(profiles)),
+                                   (LeadershipHours, self.leadershipHours(profiles)),
+                                   (PracticalScore, self.practicalScores(profiles))]:
+                count = 0
+                for batch in batched(records):
+                    model.objects.bulk_create(batch)
+                    count += len(batch)
+                self.stdout.write(f'{model.__name__}: {count}')
+            # bulk_create skips the signals that mark the profiles changed
+            profile_ids = [profile.id for profile in profiles]
+            bumpProfileVersions(profile_ids)
+            touchProfiles(profile_ids)
+
+            self.createRooms(profiles, options['rooms'], options['messages'])
+
+        # bulk_create skips the signals that keep these up to date
+        call_command('rebuild_progress_summary', stdout=self.stdout, stderr=self.stderr)
+        call_command('rebuild_room_counters', stdout=self.stdout, stderr=self.stderr)
+        call_command('rebuild_activity', stdout=self.stdout, stderr=self.stderr)
+        for model in (Profile, Room, Message):
+            updateSearchVector(model)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated an academy of {len(profiles)} students.'))
+
+    def createProfiles(self, prefix, count):
+        admin = User(username=f'{prefix}admin', is_superuser=True, is_staff=True)
+        admin.set_unusable_password()
+        users = [admin] + [User(username=f'{prefix}{i}') for i in range(count)]
+        for user in users[1:]:
+            user.set_unusable_password()
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+
+        ranks = [rank for rank, _ in Profile.BELT_RANKS]
+        users = User.objects.filter(username__startswith=prefix).order_by('id')
+        Profile.objects.bulk_create([
+            Profile(user=user,
+                    name=f'{self.rng.choice(WORDS).title()} {user.username}',
+                    rank=self.rng.choices(ranks, RANK_WEIGHTS)[0],
+                    last_promoted=self.randomDate(self.first_day))
+            for user in users
+        ], batch_size=BATCH_SIZE)
+
+        profiles = list(Profile.objects.filter(user__username__startswith=prefix)
+                        .exclude(user__username=f'{prefix}admin').order_by('id'))
+        for profile in profiles:
+            # students join over the years and train at their own pace
+            profile.joined = self.randomDate(self.first_day)
+            profile.classes_per_week = self.rng.uniform(0.5, 4)
+        return profiles
+
+    def randomDate(self, start):
+        return start + datetime.timedelta(days=self.rng.randrange(max((self.today - start).days, 1)))
+
+    def days(self, profile):
+        day = profile.joined
+        while day <= self.today:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def attendances(self, profiles):
+        for profile in profiles:
+            chance = profile.classes_per_week / 7
+            for day in self.days(profile):
+                if self.rng.random() < chance:
+                    yield Attendance(profile=profile, date=day)
+
+    def tournaments(self, profiles):
+        for profile in profiles:
+            for day in self.days(profile):
+                if self.rng.random() < 4 / 365:
+                    yield Tournament(profile=profile, event=self.rng.choice(EVENTS), date=day)
+
+    def leadershipHours(self, profiles):
+        for profile in profiles:
+            if 'Black' not in profile.rank:
+                continue
+            for day in self.days(profile):
+                if self.rng.random() < 2 / 30:
+                    yield LeadershipHours(profile=profile, event=self.rng.choice(LEADERSHIP_EVENTS),
+                                          hours=self.rng.randint(1, 3), date=day)
+
+    def practicalScores(self, profiles):
+        for profile in profiles:
+            for day in self.days(profile):
+                if day.day == 15 and day.month in (3, 6, 9, 12):
+                    yield PracticalScore(profile=profile, score=self.rng.randint(60, 100), date=day)
+
+    def createRooms(self, profiles, rooms, messages):
+        topics = [Topic.objects.get_or_create(name=name)[0] for name in TOPICS]
+        users = [profile.user_id for profile in profiles]
+
+        room_list = Room.objects.bulk_create([
+            Room(host_id=self.rng.choice(users), topic=self.rng.choice(topics),
+                 name=' '.join(self.rng.choice(WORDS) for _ in range(3)).title(),
+                 description=' '.join(self.rng.choice(WORDS) for _ in range(20)))
+            for _ in range(rooms)
+        ])
+        if connection.features.can_return_rows_from_bulk_insert:
+            room_ids = [room.id for room in room_list]
+        else:
+            room_ids = list(Room.objects.order_by('-id').values_list('id', flat=True)[:rooms])
+
+        participants = set()
+        for room_id in room_ids:
+            for user_id in self.rng.sample(users, min(len(users), self.rng.randint(2, 15))):
+                participants.add((room_id, user_id))
+        Room.participants.through.objects.bulk_create(
+            [Room.participants.through(room_id=room_id, user_id=user_id) for room_id, user_id in participants],
+            batch_size=BATCH_SIZE)
+
+        posters = sorted(participants)
+        for batch in batched(
+                Message(room_id=room_id, user_id=user_id,
+                        body=' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(5, 40))))
+                for room_id, user_id in (self.rng.choice(posters) for _ in range(messages))):
+            Message.objects.bulk_create(batch)
+        self.stdout.write(f'Rooms: {len(room_ids)}, participants: {len(participants)}, messages: {messages}')
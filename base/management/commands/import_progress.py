@@ -0,0 +1,225 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from base.forms import AttendanceForm, TournamentForm, LeadershipHoursForm, PracticalScoreForm
+from base.caching import bumpProfileVersions
+from base.management.commands.rebuild_activity import atMidnight
+from base.models import ActivityEvent, Attendance, Profile, touchProfiles
+
+RECORD_FORMS = {
+    'attendance': AttendanceForm,
+    'tournament': TournamentForm,
+    'leadership_hours': LeadershipHoursForm,
+    'practical_score': PracticalScoreForm,
+}
+
+
+def read_rows(path, fmt):
+    """Yield (line number, row dict) from a CSV or JSONL file without loading it."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_num, json.loads(line)
+
+
+def skip_to(rows, line_num):
+    for row in rows:
+        if row[0] > line_num:
+            yield row
+
+
+def clean_row(form, row):
+    """
+    Run a row through a bound-once form's fields and return (cleaned data,
+    errors). Reusing one form per record type skips the per-row form
+    construction, which otherwise dominates the cost of a large import.
+    """
+    cleaned, errors = {}, {}
+    for name, field in form.fields.items():
+        value = field.widget.value_from_datadict(row, {}, form.add_prefix(name))
+        try:
+            cleaned[name] = field.clean(value)
+        except ValidationError as e:
+            errors[name] = e.messages
+    return cleaned, errors
+
+
+def build_records(rows, profiles, default_type, errors):
+    """
+    Validate each row with the fields of the form the views use for that
+    record type and yield (line number, unsaved instance). Rejected rows go
+    to `errors`.
+    """
+    forms = {record_type: form_class() for record_type, form_class in RECORD_FORMS.items()}
+
+    for line_num, row in rows:
+        record_type = row.get('type') or default_type
+        username = row.get('username')
+        problems = {}
+
+        if record_type not in forms:
+            problems['type'] = [f'Unknown record type {record_type!r}.']
+        if username not in profiles:
+            problems['username'] = [f'No profile for username {username!r}.']
+        if not problems:
+            form = forms[record_type]
+            cleaned, problems = clean_row(form, row)
+            if not problems:
+                yield line_num, form._meta.model(profile=profiles[username], **cleaned)
+                continue
+
+        errors.append({'line': line_num, 'row': row, 'errors': problems})
+
+
+def batched(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Stream attendance, tournament, leadership hours and practical score records from a CSV or '
+            'JSONL file into the database in batches. Each row needs a username, a type (or --type) and '
+            'the fields of that record\'s form.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format. Defaults to the file extension.')
+        parser.add_argument('--type', choices=sorted(RECORD_FORMS),
+                            help='Record type for rows without a type column.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--checkpoint', help='Checkpoint file. Defaults to PATH.checkpoint.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last line recorded in the checkpoint.')
+        parser.add_argument('--errors', help='Write rejected rows to this JSONL file.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate without inserting.')
+        parser.add_argument('--skip-summary', action='store_true',
+                            help='Do not rebuild the progress summaries afterwards.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('Importing needs a database that returns the ids of bulk inserts, '
+                               'such as PostgreSQL or SQLite 3.35+.')
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+
+        state = {'line': 0, 'inserted': 0, 'skipped': 0, 'rejected': 0}
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                state.update(json.load(f))
+            self.stdout.write(f'Resuming after line {state["line"]}.')
+
+        # with their users attached, for the activity events of the new records
+        profiles = {profile.user.username: profile
+                    for profile in Profile.objects.select_related('user').only('user__username')}
+        errors = []
+        errors_file = open(options['errors'], 'a' if options['resume'] else 'w') if options['errors'] else None
+
+        rows = skip_to(read_rows(path, fmt), state['line'])
+        records = build_records(rows, profiles, options['type'], errors)
+
+        started = time.monotonic()
+        processed = 0
+        try:
+            for batch in batched(records, options['batch_size']):
+                inserted = len(batch) if options['dry_run'] else self.insert(batch)
+
+                state['line'] = batch[-1][0]
+                state['inserted'] += inserted
+                state['skipped'] += len(batch) - inserted
+                state['rejected'] += len(errors)
+                processed += len(batch) + len(errors)
+                self.flush_errors(errors, errors_file)
+                if not options['dry_run']:
+                    self.save_checkpoint(checkpoint_path, state)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'line {state["line"]}: {state["inserted"]} inserted, {state["skipped"]} '
+                                  f'duplicates, {state["rejected"]} rejected, {processed / elapsed:,.0f} rows/s')
+        finally:
+            # rows rejected after the last full batch
+            state['rejected'] += len(errors)
+            processed += len(errors)
+            self.flush_errors(errors, errors_file)
+            if errors_file:
+                errors_file.close()
+
+        elapsed = time.monotonic() - started
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {state["inserted"]} records ({state["skipped"]} duplicates, {state["rejected"]} rejected) '
+            f'in {elapsed:.1f}s, '
+            f'{processed / elapsed if elapsed else 0:,.0f} rows/s.'
+        ))
+
+        if not options['dry_run']:
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            # bulk_create skips the signals that keep ProgressSummary current
+            if not options['skip_summary']:
+                call_command('rebuild_progress_summary', stdout=self.stdout, stderr=self.stderr)
+
+    def insert(self, batch):
+        """
+        Insert a batch in one transaction, with the activity feed events and
+        profile markers post_save would have updated, and return how many
+        records were written.
+        """
+        by_model = {}
+        for line_num, record in batch:
+            by_model.setdefault(record.__class__, []).append(record)
+
+        inserted = 0
+        profile_ids = set()
+        with transaction.atomic():
+            for model, records in by_model.items():
+                if model is Attendance:
+                    # repeat attendances on a day are skipped by the unique constraint
+                    written = Attendance.insert_new(records)
+                else:
+                    # the ids come back from the insert itself
+                    model.objects.bulk_create(records)
+                    written = records
+
+                ActivityEvent.objects.bulk_create(
+                    [ActivityEvent.build(record, created=atMidnight(record.date)) for record in written])
+                inserted += len(written)
+                profile_ids.update(record.profile_id for record in written)
+
+            bumpProfileVersions(profile_ids)
+            touchProfiles(profile_ids)
+        return inserted
+
+    def flush_errors(self, errors, errors_file):
+        for error in errors:
+            if errors_file:
+                errors_file.write(json.dumps(error) + '\n')
+            else:
+                self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        errors.clear()
+
+    def save_checkpoint(self, path, state):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
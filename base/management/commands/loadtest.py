@@ -0,0 +1,270 @@
+import asyncio
+import json
+import random
+import ssl
+import statistics
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from base.models import Profile, Room
+
+# share of each action in the traffic of a check-in peak
+TRAFFIC_MIX = {
+    'roster': 40,
+    'profile': 15,
+    'stats': 10,
+    'rooms': 5,
+    'check_in': 20,
+    'room_post': 10,
+}
+
+
+class HttpSession:
+    """
+    A minimal HTTP/1.1 client on asyncio streams with one keep-alive
+    connection and a cookie jar, enough to drive the site as one browser
+    without any third-party dependency.
+    """
+    def __init__(self, base_url, timeout):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.timeout = timeout
+        self.cookies = {}
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, data=None):
+        try:
+            return await asyncio.wait_for(self.send(method, path, data), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the server dropped an idle keep-alive connection; retry once
+            await self.close()
+            return await asyncio.wait_for(self.send(method, path, data), self.timeout)
+
+    async def send(self, method, path, data):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+        body = urlencode(data).encode() if data is not None else b''
+        headers = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: keep-alive',
+            f'Content-Length: {len(body)}',
+        ]
+        if data is not None:
+            headers.append('Content-Type: application/x-www-form-urlencoded')
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join(f'{name}={value}' for name, value in self.cookies.items()))
+        self.writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        status = int(status_line.split()[1])
+
+        response_headers = defaultdict(list)
+        while (line := await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()].append(value.strip())
+
+        for header in response_headers['set-cookie']:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+
+        if response_headers['transfer-encoding'][-1:] == ['chunked']:
+            content = b''
+            while size := int((await self.reader.readline()).split(b';')[0], 16):
+                content += await self.reader.readexactly(size)
+                await self.reader.readline()
+            await self.reader.readline()
+        else:
+            content = await self.reader.readexactly(int((response_headers['content-length'] or ['0'])[0]))
+
+        if response_headers['connection'][-1:] == ['close']:
+            await self.close()
+        return status, response_headers, content
+
+
+class VirtualUser:
+    def __init__(self, session, user, profile_id, rooms, rng):
+        self.session = session
+        self.user = user
+        self.profile_id = profile_id
+        self.rooms = rooms
+        self.rng = rng
+
+    async def login(self, password):
+        await self.session.request('GET', '/login/')
+        status, headers, _ = await self.session.request('POST', '/login/', {
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', ''),
+            'username': self.user.username,
+            'password': password,
+        })
+        if status != 302 or 'sessionid' not in self.session.cookies:
+            raise CommandError(f'Could not log in as {self.user.username} (status {status}).')
+
+    def nextRequest(self):
+        action = self.rng.choices(list(TRAFFIC_MIX), weights=list(TRAFFIC_MIX.values()))[0]
+        token = {'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', '')}
+
+        if action == 'roster':
+            return 'GET', '/', None
+        if action == 'profile':
+            return 'GET', f'/profile/{self.user.id}', None
+        if action == 'stats':
+            return 'GET', f'/profile/{self.profile_id}/attendances/', None
+        if action == 'rooms':
+            return 'GET', '/rooms/', None
+        if action == 'check_in':
+            return 'POST', '/create-attendance/', {**token, 'date': timezone.localdate().isoformat()}
+        return 'POST', f'/room/{self.rng.choice(self.rooms)}', {**token, 'body': 'See you at class tonight!'}
+
+
+class Command(BaseCommand):
+    help = ('Replay a weighted mix of roster and profile views, check-ins and room posts from many logged in '
+            'users against a running server, and report throughput, latency percentiles and errors per URL '
+            'name. Users named PREFIX<n> are created with --password if they do not exist.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users.')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds of traffic after ramp-up.')
+        parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which users start.')
+        parser.add_argument('--think-time', type=float, default=1.0,
+                            help='Mean pause between requests of one user, in seconds.')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--prefix', default='loadtest_')
+        parser.add_argument('--password', default='load-test-password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the report to this JSON file.')
+        parser.add_argument('--baseline', help='Compare against the report of an earlier run, such as the same '
+                                               'load against the WSGI server before trying ASGI.')
+
+    def handle(self, *args, **options):
+        users = self.getUsers(options['prefix'], options['users'], options['password'])
+        profiles = dict(Profile.objects.filter(user__in=users).values_list('user_id', 'id'))
+        rooms = list(Room.objects.values_list('id', flat=True)[:100])
+        if not rooms:
+            raise CommandError('There are no rooms to post in. Run generate_academy first.')
+
+        samples = asyncio.run(self.run(users, profiles, rooms, options))
+        report = self.report(samples, options)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                self.compare(json.load(f), report)
+
+    def getUsers(self, prefix, count, password):
+        users = []
+        for i in range(count):
+            user, created = User.objects.get_or_create(username=f'{prefix}{i}')
+            if created or not user.check_password(password):
+                user.set_password(password)
+                user.save()
+            users.append(user)
+        return users
+
+    async def run(self, users, profiles, rooms, options):
+        rng = random.Random(options['seed'])
+        samples = []
+        started = time.perf_counter()
+        deadline = started + options['ramp_up'] + options['duration']
+
+        async def browse(delay, user, seed):
+            await asyncio.sleep(delay)
+            session = HttpSession(options['base_url'], options['timeout'])
+            visitor = VirtualUser(session, user, profiles[user.id], rooms, random.Random(seed))
+            try:
+                await visitor.login(options['password'])
+                while time.perf_counter() < deadline:
+                    method, path, data = visitor.nextRequest()
+                    request_started = time.perf_counter()
+                    try:
+                        status, headers, _ = await session.request(method, path, data)
+                        # a redirect to the login page means the session was lost
+                        error = status >= 400 or '/login/' in ''.join(headers['location'])
+                    except (OSError, asyncio.TimeoutError, ValueError):
+                        status, error = None, True
+                        await session.close()
+                    samples.append((path, status, error, request_started - started,
+                                    time.perf_counter() - request_started))
+                    await asyncio.sleep(visitor.rng.expovariate(1 / options['think_time'])
+                                        if options['think_time'] else 0)
+            finally:
+                await session.close()
+
+        self.stdout.write(f'{len(users)} users against {options["base_url"]} for '
+                          f'{options["ramp_up"] + options["duration"]:.0f}s...')
+        ramp = options['ramp_up'] / max(len(users), 1)
+        await asyncio.gather(*[browse(i * ramp, user, rng.random()) for i, user in enumerate(users)])
+        return samples
+
+    def report(self, samples, options):
+        # only count the steady state after every user has started
+        steady = [sample for sample in samples if sample[3] >= options['ramp_up']] or samples
+        by_name = defaultdict(list)
+        for path, status, error, _, elapsed in steady:
+            try:
+                name = resolve(path.split('?')[0]).url_name
+            except Resolver404:
+                name = path
+            by_name[name].append((status, error, elapsed))
+
+        duration = options['duration'] or 1
+        results = {}
+        self.stdout.write(f'{"url name":<20} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>8}')
+        for name, rows in sorted(by_name.items(), key=lambda item: -len(item[1])):
+            latencies = [elapsed * 1000 for _, _, elapsed in rows]
+            cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 \
+                else latencies * 99
+            errors = sum(error for _, error, _ in rows)
+            results[name] = {
+                'requests': len(rows),
+                'throughput': round(len(rows) / duration, 2),
+                'p50_ms': round(cuts[49], 1),
+                'p95_ms': round(cuts[94], 1),
+                'p99_ms': round(cuts[98], 1),
+                'error_rate': round(errors / len(rows), 4),
+            }
+            result = results[name]
+            self.stdout.write(f'{name:<20} {result["throughput"]:>8} {result["p50_ms"]:>8} {result["p95_ms"]:>8} '
+                              f'{result["p99_ms"]:>8} {result["error_rate"]:>8.2%}')
+
+        total = len(steady)
+        errors = sum(error for _, _, error, _, _ in steady)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} requests, {total / duration:.1f} req/s, {errors / max(total, 1):.2%} errors.'))
+        return {'users': options['users'], 'duration': options['duration'], 'requests': total,
+                'throughput': round(total / duration, 2), 'error_rate': round(errors / max(total, 1), 4),
+                'urls': results}
+
+    def compare(self, baseline, report):
+        self.stdout.write('\nAgainst the baseline:')
+        self.stdout.write(f'{"url name":<20} {"req/s":>17} {"p95 ms":>19} {"errors":>17}')
+        for name, result in report['urls'].items():
+            before = baseline['urls'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<20} new')
+                continue
+            self.stdout.write(f'{name:<20} {before["throughput"]:>7} -> {result["throughput"]:>6} '
+                              f'{before["p95_ms"]:>8} -> {result["p95_ms"]:>8} '
+                              f'{before["error_rate"]:>6.2%} -> {result["error_rate"]:>6.2%}')
+        self.stdout.write(f'{"total":<20} {baseline["throughput"]:>7} -> {report["throughput"]:>6} '
+                          f'{"":>19} {baseline["error_rate"]:>6.2%} -> {report["error_rate"]:>6.2%}')
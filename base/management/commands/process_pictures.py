@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from base.images import needsVariants, processPicture
+from base.models import Profile
+
+
+class Command(BaseCommand):
+    help = ('Generate the resized profile picture variants that are missing or stale, for pictures uploaded '
+            'before the background pipeline or whose job was lost on a restart.')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(picture__endswith='.svg').only('id', 'picture', 'picture_variants')
+
+        processed = 0
+        for profile in profiles.iterator():
+            if needsVariants(profile):
+                processPicture(profile.pk)
+                processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} profile pictures.'))
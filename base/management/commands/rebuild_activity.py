@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from base.models import ActivityEvent, Attendance, Tournament, LeadershipHours, PracticalScore, Message, Profile
+
+BATCH_SIZE = 2000
+
+
+def atMidnight(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+
+def getEvents():
+    """Yield an event for every message, stat record and ranked profile, oldest records first per table."""
+    for message in Message.objects.select_related('user', 'room').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        yield ActivityEvent.build(message)
+
+    # stat records only have a date, so their events are placed at its start
+    for model in (Attendance, Tournament, LeadershipHours, PracticalScore):
+        records = model.objects.filter(profile__isnull=False).select_related('profile__user').order_by('id')
+        for record in records.iterator(chunk_size=BATCH_SIZE):
+            yield ActivityEvent.build(record, created=atMidnight(record.date))
+
+    profiles = Profile.objects.exclude(rank=None).exclude(rank='').select_related('user')
+    for profile in profiles.iterator(chunk_size=BATCH_SIZE):
+        yield ActivityEvent.build(profile, created=atMidnight(profile.last_promoted))
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the activity feed from the messages, stat records and ranks. The signals append to it '
+            'as things happen; run this after migrating or bulk loads.')
+
+    def handle(self, *args, **options):
+        count = 0
+        with transaction.atomic():
+            ActivityEvent.objects.all().delete()
+            batch = []
+            for event in getEvents():
+                batch.append(event)
+                if len(batch) == BATCH_SIZE:
+                    ActivityEvent.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            ActivityEvent.objects.bulk_create(batch)
+            count += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the activity feed with {count} events.'))
@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from base.caching import invalidateRoster
+from base.models import Attendance, Tournament, LeadershipHours, PracticalScore, ProgressSummary, getPeriod
+
+
+def compute_summaries():
+    """Aggregate every stat record into {(profile_id, start, end): values}."""
+    summaries = defaultdict(lambda: {
+        'attendance_count': 0,
+        'tournament_count': 0,
+        'leadership_hours_total': 0,
+        'practical_score_latest': 0,
+    })
+
+    # group by day in SQL, then bucket the days into periods in Python since
+    # periods are configurable and cannot be expressed as a date extract
+    for column, model, aggregate in [('attendance_count', Attendance, Count('id')),
+                                     ('tournament_count', Tournament, Count('id')),
+                                     ('leadership_hours_total', LeadershipHours, Sum('hours'))]:
+        days = model.objects.filter(profile__isnull=False).values('profile_id', 'date') \
+            .order_by().annotate(total=aggregate)
+        for row in days.iterator(chunk_size=2000):
+            period = getPeriod(row['date'])
+            summaries[(row['profile_id'], period.start, period.end)][column] += row['total'] or 0
+
+    # walk scores oldest to newest so the last one seen per period wins,
+    # matching ProgressSummary.latest_score()
+    scores = PracticalScore.objects.filter(profile__isnull=False) \
+        .order_by('profile_id', 'date', 'id').values_list('profile_id', 'date', 'score')
+    for profile_id, date, score in scores.iterator(chunk_size=2000):
+        period = getPeriod(date)
+        summaries[(profile_id, period.start, period.end)]['practical_score_latest'] = score or 0
+
+    return summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the ProgressSummary table from the raw stat records and verify it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the existing table against the raw records.')
+
+    def handle(self, *args, **options):
+        expected = compute_summaries()
+
+        if not options['check']:
+            with transaction.atomic():
+                ProgressSummary.objects.all().delete()
+                ProgressSummary.objects.bulk_create(
+                    [ProgressSummary(profile_id=profile_id, start=start, end=end, **values)
+                     for (profile_id, start, end), values in expected.items()],
+                    batch_size=1000
+                )
+                # bulk_create skips the signals that invalidate the cached roster
+                invalidateRoster()
+            self.stdout.write(f'Rebuilt {len(expected)} progress summaries.')
+
+        mismatches = self.verify(expected)
+        if mismatches:
+            for message in mismatches[:20]:
+                self.stderr.write(message)
+            raise CommandError(f'{len(mismatches)} progress summaries do not match the raw records.')
+        self.stdout.write(self.style.SUCCESS('Progress summaries match the raw records.'))
+
+    def verify(self, expected):
+        mismatches = []
+        seen = set()
+        for summary in ProgressSummary.objects.order_by().iterator(chunk_size=2000):
+            key = (summary.profile_id, summary.start, summary.end)
+            seen.add(key)
+            values = expected.get(key)
+            actual = {column: getattr(summary, column) for column in (values or {})}
+            if values is None:
+                # rows left at zero after deletes are harmless
+                if any([summary.attendance_count, summary.tournament_count,
+                        summary.leadership_hours_total, summary.practical_score_latest]):
+                    mismatches.append(f'{summary} has no records but is not empty')
+            elif actual != values:
+                mismatches.append(f'{summary} is {actual}, expected {values}')
+
+        for key in expected.keys() - seen:
+            mismatches.append(f'Missing progress summary for profile {key[0]} from {key[1]} to {key[2]}')
+        return mismatches
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from base.models import Room, Topic, getRoomCounts, getTopicCounts
+
+
+def getMismatches(model, counts):
+    """Rows of `model` whose counter columns differ from what `counts` computes."""
+    expected = {f'expected_{field}': expression for field, expression in counts.items()}
+    rows = model.objects.annotate(**expected).values('id', *counts, *expected).iterator(chunk_size=2000)
+    return [row for row in rows if any(row[field] != row[f'expected_{field}'] for field in counts)]
+
+
+class Command(BaseCommand):
+    help = ('Recount the message, participant and last activity columns of every room and the room count of '
+            'every topic from the rows they count, and verify them. The views keep them up to date; run this '
+            'after migrating, bulk loads or edits made through the admin.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the existing counters against the rows they count.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            with transaction.atomic():
+                rooms = Room.objects.update(**getRoomCounts())
+                topics = Topic.objects.update(**getTopicCounts())
+            self.stdout.write(f'Recounted {rooms} rooms and {topics} topics.')
+
+        mismatches = [(Room, row) for row in getMismatches(Room, getRoomCounts())] + \
+            [(Topic, row) for row in getMismatches(Topic, getTopicCounts())]
+        if mismatches:
+            for model, row in mismatches[:20]:
+                self.stderr.write(f'{model.__name__} {row["id"]}: {row}')
+            raise CommandError(f'{len(mismatches)} rooms and topics have counters that do not match.')
+        self.stdout.write(self.style.SUCCESS('Room and topic counters match the rows they count.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from base.search import SEARCH_VECTORS, createSearchIndexes, isPostgres, updateSearchVector
+
+
+class Command(BaseCommand):
+    help = 'Create the search indexes and refresh every stored search vector.'
+
+    def handle(self, *args, **options):
+        if not isPostgres():
+            self.stdout.write('Search vectors are only stored on Postgres; nothing to do.')
+            return
+
+        createSearchIndexes()
+        for model in SEARCH_VECTORS:
+            updated = updateSearchVector(model)
+            self.stdout.write(f'Refreshed {updated} {model._meta.verbose_name_plural}.')
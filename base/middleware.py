@@ -0,0 +1,299 @@
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import FileResponse, HttpResponse
+from django.template.backends.django import Template
+from django.utils import timezone
+
+logger = logging.getLogger('base.requests')
+
+# the stats of the request being handled, read by the template hook below
+current_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        # parameterised SQL, so the same statement with different values
+        # counts as one shape; many of one shape is the N+1 signature
+        self.shapes = Counter()
+        self.exact = Counter()
+        # the async views run queries of one request on several threads
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.sql_time += time.perf_counter() - started
+                self.queries += 1
+                self.shapes[sql] += 1
+                if not many:
+                    try:
+                        self.exact[(sql, tuple(params or ()))] += 1
+                    except TypeError:
+                        # unhashable params such as lists for __in lookups
+                        pass
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.exact.values() if count > 1)
+
+    def repeated_shapes(self, threshold):
+        return [(sql, count) for sql, count in self.shapes.most_common(3) if count >= threshold]
+
+
+def countQuery(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def trackQueries(connection=None, **kwargs):
+    """
+    Count the queries of `connection`, or of every connection of this thread,
+    towards the request in the current context. The wrapper stays installed,
+    so queries a request hands to other threads (the async views' pool, the
+    thread a sync view runs on under ASGI) count too. It goes first in the
+    list so execute_wrapper() blocks around it still pop their own.
+    """
+    for connection in [connection] if connection else connections.all():
+        if countQuery not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, countQuery)
+
+
+def timedRender(render):
+    @functools.wraps(render)
+    def wrapper(self, *args, **kwargs):
+        stats = current_stats.get()
+        if stats is None:
+            return render(self, *args, **kwargs)
+
+        # only the outermost render is timed, render_to_string calls made
+        # while rendering are already inside it
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - started
+    return wrapper
+
+
+# how many requests are timing their templates right now
+timing_requests = 0
+timing_lock = threading.Lock()
+
+
+@contextmanager
+def timingTemplates():
+    """
+    Time the template renders of the current context while the block runs.
+    Template.render is wrapped while any request is being timed and put
+    back after the last one, so renders outside requests (management
+    commands, tests, other threads when the site is idle) are never patched.
+    """
+    global timing_requests
+    with timing_lock:
+        if not timing_requests:
+            Template.render = timedRender(Template.render)
+        timing_requests += 1
+    try:
+        yield
+    finally:
+        with timing_lock:
+            timing_requests -= 1
+            if not timing_requests:
+                Template.render = Template.render.__wrapped__
+
+
+class RequestTimingMiddleware:
+    """
+    Count the queries, SQL time, repeated queries and template render time of
+    each request. They are sent as a Server-Timing header and requests over
+    the REQUEST_TIMING thresholds are logged to 'base.requests' as JSON.
+    Works in both sync and async middleware chains.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # the same marker MiddlewareMixin sets so the handler awaits us
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        options = getattr(settings, 'REQUEST_TIMING', {})
+        self.slow_ms = options.get('SLOW_REQUEST_MS', 500)
+        self.max_queries = options.get('MAX_QUERIES', 50)
+        self.repeat_threshold = options.get('REPEATED_QUERY_THRESHOLD', 10)
+        self.header = options.get('SERVER_TIMING_HEADER', True)
+
+        connection_created.connect(trackQueries, dispatch_uid='base.middleware.trackQueries')
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        # connections opened before the signal was connected
+        trackQueries()
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            with timingTemplates():
+                response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        # the context, and with it the stats, is copied into every thread
+        # sync_to_async runs the request's database work on
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            with timingTemplates():
+                response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        total = (time.perf_counter() - stats.started) * 1000
+        sql = stats.sql_time * 1000
+        templates = stats.template_time * 1000
+
+        if self.header:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={sql:.1f};desc="{stats.queries} queries, {stats.duplicates} duplicates"',
+                f'tpl;dur={templates:.1f}',
+                f'total;dur={total:.1f}',
+            ])
+
+        repeated = stats.repeated_shapes(self.repeat_threshold)
+        if total >= self.slow_ms or stats.queries >= self.max_queries or repeated:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                'status': response.status_code,
+                'total_ms': round(total, 1),
+                'sql_ms': round(sql, 1),
+                'template_ms': round(templates, 1),
+                'queries': stats.queries,
+                'duplicates': stats.duplicates,
+                'repeated': [{'sql': statement[:300], 'count': count} for statement, count in repeated],
+            }))
+
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Run a request under cProfile when a superuser adds ?cprofile=1, and
+    answer with the top of the profile, or with the .prof file itself for
+    ?cprofile=download. Every capture is kept in PROFILER['DIR'], newest
+    PROFILER['KEEP'] files only, so runs before and after a deploy can be
+    compared with pstats or snakeviz. Other requests only pay a GET lookup.
+    cProfile only sees its own thread, so under ASGI the profile shows the
+    event loop, and the work async views hand to the pool threads appears as
+    time spent waiting on it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        options = getattr(settings, 'PROFILER', {})
+        self.directory = options.get('DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+        self.keep = options.get('KEEP', 50)
+        self.lines = options.get('LINES', 40)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        mode = request.GET.get('cprofile')
+        if not mode or not request.user.is_superuser:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.report(profiler, request, response, mode)
+
+    async def __acall__(self, request):
+        mode = request.GET.get('cprofile')
+        # request.user is loaded lazily and may need a query
+        if not mode or not await sync_to_async(lambda: request.user.is_superuser)():
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        return await sync_to_async(self.report)(profiler, request, response, mode)
+
+    def report(self, profiler, request, response, mode):
+        path = self.save(profiler, request)
+        if mode == 'download':
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(self.lines)
+        stats.sort_stats('tottime').print_stats(self.lines // 2)
+
+        report = HttpResponse(output.getvalue(), content_type='text/plain; charset=utf-8')
+        report['X-Profile-File'] = os.path.basename(path)
+        report['X-Profiled-Status'] = response.status_code
+        return report
+
+    def save(self, profiler, request):
+        os.makedirs(self.directory, exist_ok=True)
+
+        name = getattr(request.resolver_match, 'view_name', None) or request.path
+        name = re.sub(r'[^\w.-]+', '-', name).strip('-') or 'root'
+        path = os.path.join(self.directory, f'{timezone.now():%Y%m%dT%H%M%S.%f}-{name}.prof')
+        profiler.dump_stats(path)
+
+        captures = sorted(entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.prof'))
+        for old in captures[:-self.keep]:
+            # another worker pruning at the same time may have removed it
+            with suppress(FileNotFoundError):
+                os.remove(old)
+        return path
@@ -1,22 +1,178 @@
+import bisect
+import copy
+import datetime
+import time
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.db.models import Count, F, FilteredRelation, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.fields.files import FieldFile
+from django.db.models.functions import Coalesce
+from django.templatetags.static import static
 from django.utils import timezone
-from PIL import Image
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
 
-def getRecentDates(model, profile):
-    if timezone.localdate().month <= 3:
-        dates = model.objects.filter(date__month__range=['01', '03'], date__year=timezone.localdate().year, profile=profile)
-    elif timezone.localdate().month > 3 and timezone.localdate().month <= 6:
-        dates = model.objects.filter(date__month__range=['04', '06'], date__year=timezone.localdate().year, profile=profile)
-    elif timezone.localdate().month > 6 and timezone.localdate().month <= 9:
-        dates = model.objects.filter(date__month__range=['07', '09'], date__year=timezone.localdate().year, profile=profile)
-    elif timezone.localdate().month > 9 and timezone.localdate().month <= 12:
-        dates = model.objects.filter(date__month__range=['10', '12'], date__year=timezone.localdate().year, profile=profile)
+from .caching import bumpProfileVersions
+from .images import schedulePicture
+
+def getQuarterRange(year, quarter):
+    """Return the half-open [start, end) dates of a calendar quarter."""
+    start = datetime.date(year, (quarter - 1) * 3 + 1, 1)
+    if quarter == 4:
+        end = datetime.date(year + 1, 1, 1)
     else:
-        dates = model.objects.filter(profile=profile)
+        end = datetime.date(year, quarter * 3 + 1, 1)
+    return start, end
+
+def getPeriodFilter(start, end, field='date'):
+    # plain range comparisons on the column, unlike date__year/date__quarter
+    # which compile to EXTRACT() and cannot use the (profile, date) indexes
+    return {f'{field}__gte': start, f'{field}__lt': end}
+
+class ProgressPeriod(models.Model):
+    """
+    A testing cycle that progress is counted over. Dates not covered by any
+    configured period fall back to their calendar quarter, clipped to the gap
+    between the neighbouring periods.
+    """
+    name = models.CharField(max_length=50)
+    start = models.DateField(unique=True)
+    end = models.DateField(help_text='First day after the period.')
+
+    class Meta:
+        ordering = ['-start']
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.start and self.end and self.end <= self.start:
+            raise ValidationError('A period must end after it starts.')
+        overlapping = ProgressPeriod.objects.filter(start__lt=self.end, end__gt=self.start).exclude(pk=self.pk)
+        if self.start and self.end and overlapping.exists():
+            raise ValidationError('Periods cannot overlap.')
+
+    @classmethod
+    def for_quarter(cls, date, after=None, before=None):
+        """
+        Return the calendar quarter of `date`, clipped to start no earlier than
+        `after` and end no later than `before` so it never overlaps the
+        configured periods on either side.
+        """
+        year, quarter = date.year, (date.month - 1) // 3 + 1
+        start, end = getQuarterRange(year, quarter)
+        if after is not None:
+            start = max(start, after)
+        if before is not None:
+            end = min(end, before)
+        return cls(name=f'Q{quarter} {year}', start=start, end=end)
+
+    def contains(self, date):
+        return self.start <= date < self.end
+
+    def get_records(self, model):
+        return model.objects.filter(**getPeriodFilter(self.start, self.end))
+
+class ProgressPeriodCalendar:
+    """
+    In-process copy of the ProgressPeriod table. Lookups bisect a sorted list
+    of start dates instead of querying; the copy is dropped when a period is
+    saved or deleted and reloaded at least every `timeout` seconds so other
+    worker processes pick up changes.
+    """
+    timeout = 300
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # lookups may run in other threads, so the loaded state is a single
+        # (loaded_at, starts, periods) tuple that is only ever swapped whole
+        self._snapshot = None
+        self._current = (None, None, None)
+
+    def _load(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot[0] > self.timeout:
+            periods = list(ProgressPeriod.objects.order_by('start'))
+            snapshot = (time.monotonic(), [period.start for period in periods], periods)
+            self._snapshot = snapshot
+        return snapshot
+
+    def _find(self, snapshot, date):
+        _, starts, periods = snapshot
+        i = bisect.bisect_right(starts, date) - 1
+        if i >= 0 and periods[i].contains(date):
+            return periods[i]
+        after = periods[i].end if i >= 0 else None
+        before = periods[i + 1].start if i + 1 < len(periods) else None
+        return ProgressPeriod.for_quarter(date, after, before)
+
+    def get(self, date):
+        return self._find(self._load(), date)
+
+    def current(self):
+        snapshot = self._load()
+        today = timezone.localdate()
+        loaded, day, period = self._current
+        if loaded is not snapshot or day != today:
+            period = self._find(snapshot, today)
+            self._current = (snapshot, today, period)
+        return period
+
+period_calendar = ProgressPeriodCalendar()
+
+def getPeriod(date):
+    return period_calendar.get(date)
+
+def getCurrentPeriod():
+    return period_calendar.current()
+
+def getRecentDates(model, profile):
+    period = getCurrentPeriod()
+    dates = model.objects.filter(profile=profile, **getPeriodFilter(period.start, period.end))
 
     return dates
 
+class ProfileQuerySet(models.QuerySet):
+    def with_current_progress(self):
+        """
+        Annotate each profile with its current period attendance_count,
+        tournament_count, leadership_hours_total and practical_score_latest
+        from ProgressSummary so a whole roster is fetched in a single query.
+        """
+        return self.with_progress(getCurrentPeriod())
+
+    def with_progress(self, period):
+        """Like with_current_progress, for any period."""
+        return self.annotate(
+            current_summary=FilteredRelation('progress_summary', condition=Q(
+                progress_summary__start=period.start)),
+            attendance_count=Coalesce(F('current_summary__attendance_count'), Value(0)),
+            tournament_count=Coalesce(F('current_summary__tournament_count'), Value(0)),
+            leadership_hours_total=Coalesce(F('current_summary__leadership_hours_total'), Value(0)),
+            practical_score_latest=Coalesce(F('current_summary__practical_score_latest'), Value(0)),
+        )
+
+class ProfilePicture:
+    def __init__(self, url, webp=None):
+        self.url = url
+        self.webp = webp
+
+    def __str__(self):
+        return self.url
+
+def copyLoadedValue(value):
+    # a copy, so a dict or file name edited in place still reads as changed
+    if isinstance(value, FieldFile):
+        return value.name
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
 class Profile(models.Model):
     BROWN = 'Brown'
     SR_BROWN = 'Sr. Brown'
@@ -46,30 +202,40 @@ class Profile(models.Model):
     picture = models.ImageField(default="default.svg", upload_to='profile_pictures/', null=True)
     rank = models.CharField(max_length=20, choices=BELT_RANKS, null=True, blank=True)
     last_promoted = models.DateField(default=timezone.localdate)
+    # resized copies written by base.images: {'source': picture name,
+    # 'small': {'webp': name, 'jpeg': name}, 'medium': {...}}
+    picture_variants = models.JSONField(default=dict, blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # when the profile or any of its stat records last changed, deletes
+    # included, for the conditional profile and stats pages; see touchProfiles
+    last_changed = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = ProfileQuerySet.as_manager()
+
+    @cached_property
+    def current_progress(self):
+        period = getCurrentPeriod()
+        summary = ProgressSummary.objects.filter(profile=self, start=period.start).first()
+        if summary is None:
+            summary = ProgressSummary(profile=self, start=period.start, end=period.end)
+        return summary
 
     @property
     def current_attendances(self):
-        return getRecentDates(Attendance, self).count()
+        return self.current_progress.attendance_count
     
     @property
     def current_tournaments(self):
-        return getRecentDates(Tournament, self).count()
+        return self.current_progress.tournament_count
     
     @property
     def current_leadership_hours(self):
-        leadership_hours = getRecentDates(LeadershipHours, self)
-        current_hours = 0
-        for h in leadership_hours:
-            current_hours += h.hours
-        return current_hours
+        return self.current_progress.leadership_hours_total
     
     @property
     def current_practical_score(self):
-        practical_scores =  getRecentDates(PracticalScore, self)
-        if not practical_scores:
-            return 0
-        else:
-            return practical_scores.first().score
+        return self.current_progress.practical_score_latest
         
     def get_recent_attendances(self):
         return getRecentDates(Attendance, self)
@@ -86,55 +252,179 @@ class Profile(models.Model):
     def __str__(self):
         return f'{self.user.username}\'s Profile'
     
+    def get_picture(self, size):
+        """The WebP and JPEG urls of a picture size, or the original until they are generated."""
+        variants = self.picture_variants if self.picture_variants.get('source') == self.picture.name else {}
+        if size not in variants:
+            return ProfilePicture(static(self.picture.url))
+        # under /static/ like the original, since /images/ is only routed with DEBUG on
+        storage = self.picture.storage
+        return ProfilePicture(static(storage.url(variants[size]['jpeg'])),
+                              static(storage.url(variants[size]['webp'])))
+
+    @property
+    def small_picture(self):
+        return self.get_picture('small')
+
+    @property
+    def medium_picture(self):
+        return self.get_picture('medium')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: copyLoadedValue(value) for name, value in zip(field_names, values)}
+        return instance
+
+    def get_dirty_fields(self):
+        """Names of the fields changed since the profile was loaded or last saved."""
+        loaded = getattr(self, '_loaded_values', None)
+        fields = self._meta.concrete_fields
+        if self._state.adding or loaded is None:
+            return {field.name for field in fields if not field.primary_key}
+        # deferred fields were never loaded, so they cannot have been changed
+        return {field.name for field in fields
+                if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]}
+
     def save(self, *args, **kwargs):
-        # save the profile first
+        dirty = self.get_dirty_fields()
+        self.last_changed = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            # auto_now only applies to the fields being saved
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at', 'last_changed'}
         super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: copyLoadedValue(getattr(self, field.attname))
+                               for field in self._meta.concrete_fields
+                               if field.attname not in self.get_deferred_fields()}
+
+        # resizing a large upload is too slow for the request, so the
+        # variants are generated on a background pool after commit
+        if 'picture' in dirty:
+            schedulePicture(self)
 
-        # resize the image
-        if not self.picture.url.endswith('.svg'):
-            img = Image.open(self.picture.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                # create a thumbnail
-                img.thumbnail(output_size)
-                # overwrite the larger image
-                img.save(self.picture.path)
+def touchProfiles(profile_ids):
+    """
+    Move the last_changed marker of these profiles to now, for writes to
+    their stat records. It is updated in the writing transaction, so the
+    next page load after a redirect already sees it.
+    """
+    profile_ids = {profile_id for profile_id in profile_ids if profile_id is not None}
+    if profile_ids:
+        Profile.objects.filter(id__in=profile_ids).update(last_changed=timezone.now())
 
 class Attendance(models.Model):
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='attendance')
+    # the (profile, date) index below leads with the profile, so a separate
+    # foreign key index would only compete with it in the planner
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='attendance',
+                                db_index=False)
     date = models.DateField(default=timezone.localdate)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.__class__.__name__ + " for " + self.profile.name + " on " + self.date.strftime("%b %d, %Y")
     
     class Meta:
         ordering = ['-date']
+        # the unique (profile, date) index also serves the period range scans
+        # the other stat models get from their (profile, -date) index
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'date'], name='unique_attendance_per_day'),
+        ]
+
+    @classmethod
+    def insert_new(cls, attendances):
+        """
+        Insert the attendances whose profile and day are not taken yet and
+        return the ones written, with their ids set. Call it inside a
+        transaction. Skipped conflicts return no ids, so they are looked up
+        by the exact (profile, date) keys.
+        """
+        if connection.vendor == 'postgresql':
+            # hold off other writers until the transaction commits, so no one
+            # else's row can take one of the keys between the two reads below;
+            # SQLite already refuses a write after another commits mid-transaction
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(cls._meta.db_table)} '
+                               f'IN SHARE ROW EXCLUSIVE MODE')
+
+        keys = cls.objects.filter(profile_id__in={attendance.profile_id for attendance in attendances},
+                                  date__in={attendance.date for attendance in attendances})
+        existing = set(keys.values_list('profile_id', 'date'))
+        cls.objects.bulk_create(attendances, ignore_conflicts=True)
+        ids = {(profile_id, date): pk for pk, profile_id, date in keys.values_list('id', 'profile_id', 'date')
+               if (profile_id, date) not in existing}
+
+        written = []
+        for attendance in attendances:
+            # the first of a repeat in the list is the one written
+            pk = ids.pop((attendance.profile_id, attendance.date), None)
+            if pk is not None:
+                attendance.pk = pk
+                written.append(attendance)
+        return written
+
+    @classmethod
+    def check_in(cls, date, profile_ids):
+        """
+        Record attendance on `date` for every profile in one INSERT, skipping
+        students already checked in that day. bulk_create does not send
+        post_save, so the period's summaries and the activity feed are
+        refreshed here instead. Returns the refreshed ProgressSummary rows
+        keyed by profile id.
+        """
+        profile_ids = set(profile_ids)
+        with transaction.atomic():
+            written = cls.insert_new([cls(profile_id=profile_id, date=date) for profile_id in profile_ids])
+            attendances = cls.objects.filter(id__in=[attendance.pk for attendance in written]) \
+                .select_related('profile__user')
+            ActivityEvent.objects.bulk_create([ActivityEvent.build(attendance) for attendance in attendances])
+            period = getPeriod(date)
+            bumpProfileVersions(profile_ids)
+            touchProfiles([attendance.profile_id for attendance in written])
+            return ProgressSummary.refresh_many(profile_ids, period.start, period.end)
 
 class Tournament(models.Model):
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='tournament')
+    # covered by the (profile, -date) index
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='tournament',
+                                db_index=False)
     event = models.CharField(max_length=30, null=True)
     date = models.DateField(default=timezone.localdate)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.__class__.__name__ + " for " + self.profile.name + " for " + self.event + " on " + self.date.strftime("%b %d, %Y")
     
     class Meta:
         ordering = ['-date', 'event']
+        indexes = [
+            models.Index(fields=['profile', '-date'], name='tournament_profile_date_idx'),
+        ]
     
 class LeadershipHours(models.Model):
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='leadership_hour')
+    # covered by the (profile, -date) index
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='leadership_hour',
+                                db_index=False)
     event = models.CharField(max_length=30)
     date = models.DateField(default=timezone.localdate)
     hours = models.IntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         string = self.__class__.__name__ + " for " + self.profile.name + " for " + self.event + " on " + self.date.strftime("%b %d, %Y") + " for " + str(self.hours) + " hours "
         return string
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', '-date'], name='leadership_profile_date_idx'),
+        ]
+
 class PracticalScore(models.Model):
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='practical_score')
+    # covered by the (profile, -date) index
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, related_name='practical_score',
+                                db_index=False)
     date = models.DateField(default=timezone.localdate)
     score = models.IntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         string = self.__class__.__name__ + " for " + self.profile.name + " on " + self.date.strftime("%b %d, %Y") + " with score " + str(self.score)
@@ -142,9 +432,14 @@ class PracticalScore(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['profile', '-date'], name='practical_profile_date_idx'),
+        ]
 
 class Topic(models.Model):
     name = models.CharField(max_length=200)
+    # kept in step by the room views, see rebuild_room_counters
+    room_count = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -157,6 +452,13 @@ class Room(models.Model):
     participants = models.ManyToManyField(User, related_name='participants', blank=True)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # kept in step by the room and message views and the count_participants
+    # signal, see rebuild_room_counters
+    message_count = models.IntegerField(default=0, editable=False)
+    participant_count = models.IntegerField(default=0, editable=False)
+    # when the newest message was posted, None before the first one
+    last_activity = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-updated', '-created']
@@ -170,9 +472,241 @@ class Message(models.Model):
     body = models.TextField()
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-updated', '-created']
 
     def __str__(self):
-        return self.body[0:50]
\ No newline at end of file
+        return self.body[0:50]
+
+def getRoomCounts():
+    """
+    Expressions that compute each Room counter from the rows it counts, to
+    rebuild the counters in one UPDATE or check them in one query.
+    """
+    messages = Message.objects.filter(room=OuterRef('pk')).order_by().values('room')
+    participants = Room.participants.through.objects.filter(room=OuterRef('pk')).order_by().values('room')
+    return {
+        'message_count': Coalesce(Subquery(messages.annotate(count=Count('id')).values('count')), 0),
+        'participant_count': Coalesce(Subquery(participants.annotate(count=Count('id')).values('count')), 0),
+        'last_activity': Subquery(messages.annotate(newest=Max('created')).values('newest')),
+    }
+
+def getTopicCounts():
+    rooms = Room.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    return {'room_count': Coalesce(Subquery(rooms.annotate(count=Count('id')).values('count')), 0)}
+
+class ProgressSummary(models.Model):
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='progress_summary')
+    start = models.DateField()
+    end = models.DateField()
+    attendance_count = models.IntegerField(default=0)
+    tournament_count = models.IntegerField(default=0)
+    leadership_hours_total = models.IntegerField(default=0)
+    practical_score_latest = models.IntegerField(default=0)
+
+    METRICS = ['attendance_count', 'tournament_count', 'leadership_hours_total', 'practical_score_latest']
+
+    class Meta:
+        ordering = ['-start']
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'start'], name='unique_progress_summary'),
+        ]
+
+    def __str__(self):
+        return f'Progress for profile {self.profile_id} from {self.start} to {self.end}'
+
+    @staticmethod
+    def latest_score(profile_id, start, end):
+        score = PracticalScore.objects.filter(profile_id=profile_id, **getPeriodFilter(start, end)) \
+            .order_by('-date', '-id').values_list('score', flat=True).first()
+        return score or 0
+
+    @classmethod
+    def compute(cls, profile_id, start, end):
+        """Aggregate one period of raw stat records for a profile."""
+        def records(model):
+            return model.objects.filter(profile_id=profile_id, **getPeriodFilter(start, end))
+
+        return {
+            'attendance_count': records(Attendance).count(),
+            'tournament_count': records(Tournament).count(),
+            'leadership_hours_total': records(LeadershipHours).aggregate(total=Sum('hours'))['total'] or 0,
+            'practical_score_latest': cls.latest_score(profile_id, start, end),
+        }
+
+    @classmethod
+    def refresh_many(cls, profile_ids, start, end):
+        """
+        Recompute one period for many profiles with a fixed number of grouped
+        queries, and return the summaries keyed by profile id.
+        """
+        values = {profile_id: {
+            'attendance_count': 0,
+            'tournament_count': 0,
+            'leadership_hours_total': 0,
+            'practical_score_latest': 0,
+        } for profile_id in profile_ids}
+
+        def grouped(model, aggregate):
+            return model.objects.filter(profile_id__in=values, **getPeriodFilter(start, end)) \
+                .values('profile_id').order_by().annotate(total=aggregate)
+
+        for column, model, aggregate in [('attendance_count', Attendance, Count('id')),
+                                         ('tournament_count', Tournament, Count('id')),
+                                         ('leadership_hours_total', LeadershipHours, Sum('hours'))]:
+            for row in grouped(model, aggregate):
+                values[row['profile_id']][column] = row['total'] or 0
+
+        scores = PracticalScore.objects.filter(profile_id__in=values, **getPeriodFilter(start, end)) \
+            .order_by('profile_id', 'date', 'id').values_list('profile_id', 'score')
+        for profile_id, score in scores:
+            values[profile_id]['practical_score_latest'] = score or 0
+
+        summaries = {summary.profile_id: summary for summary in
+                     cls.objects.filter(profile_id__in=values, start=start)}
+        for profile_id, columns in values.items():
+            summary = summaries.setdefault(profile_id, cls(profile_id=profile_id, start=start))
+            summary.end = end
+            for column, value in columns.items():
+                setattr(summary, column, value)
+
+        cls.objects.bulk_update([summary for summary in summaries.values() if summary.pk],
+                                ['end', *cls.METRICS])
+        cls.objects.bulk_create([summary for summary in summaries.values() if not summary.pk],
+                                ignore_conflicts=True)
+        return summaries
+
+    @classmethod
+    def refresh_dates(cls, records):
+        """
+        Refresh every period touched by (profile_id, date) pairs, for bulk
+        UPDATEs and DELETEs that do not send the signals.
+        """
+        periods = {}
+        for profile_id, date in records:
+            if profile_id is not None:
+                period = getPeriod(date)
+                periods.setdefault((period.start, period.end), set()).add(profile_id)
+
+        for (start, end), profile_ids in periods.items():
+            cls.refresh_many(profile_ids, start, end)
+        touched = {profile_id for profile_ids in periods.values() for profile_id in profile_ids}
+        bumpProfileVersions(touched)
+        touchProfiles(touched)
+
+    @classmethod
+    def refresh(cls, profile_id, start, end):
+        summary, created = cls.objects.update_or_create(
+            profile_id=profile_id, start=start,
+            defaults=dict(end=end, **cls.compute(profile_id, start, end))
+        )
+        return summary
+
+class ActivityEvent(models.Model):
+    """
+    One entry of the recent activity feed: a message posted, a stat record
+    logged or a promotion. The signals append one as each happens, with the
+    actor's and room's names copied in, so a page of the feed is a single
+    range scan of the (created, id) index without joining the tables the
+    events came from.
+    """
+    MESSAGE = 'message'
+    ATTENDANCE = 'attendance'
+    TOURNAMENT = 'tournament'
+    LEADERSHIP_HOURS = 'leadership_hours'
+    PRACTICAL_SCORE = 'practical_score'
+    PROMOTION = 'promotion'
+
+    KINDS = (
+        (MESSAGE, 'Message'),
+        (ATTENDANCE, 'Attendance'),
+        (TOURNAMENT, 'Tournament'),
+        (LEADERSHIP_HOURS, 'Leadership hours'),
+        (PRACTICAL_SCORE, 'Practical score'),
+        (PROMOTION, 'Promotion'),
+    )
+
+    MODEL_KINDS = {
+        Message: MESSAGE,
+        Attendance: ATTENDANCE,
+        Tournament: TOURNAMENT,
+        LeadershipHours: LEADERSHIP_HOURS,
+        PracticalScore: PRACTICAL_SCORE,
+        Profile: PROMOTION,
+    }
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # the message, stat record or promoted profile the event is about
+    object_id = models.IntegerField()
+    # only set for messages, so deleting a message or its room takes the
+    # events with it in one DELETE per batch of messages
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    actor_username = models.CharField(max_length=150)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    room_name = models.CharField(max_length=200, blank=True)
+    summary = models.CharField(max_length=200)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created', '-id']
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='activity_created_idx'),
+            models.Index(fields=['kind', 'object_id'], name='activity_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.actor_username}: {self.summary[0:50]}'
+
+    @staticmethod
+    def summarize(instance):
+        """What the feed says about a message, stat record or promoted profile."""
+        def value(field):
+            # views assign raw POST strings to the stat fields
+            return instance._meta.get_field(field).to_python(instance.__dict__.get(field))
+
+        if isinstance(instance, Message):
+            summary = instance.body
+        elif isinstance(instance, Attendance):
+            summary = 'Checked in for class'
+        elif isinstance(instance, Tournament):
+            summary = f'Competed in {value("event") or "a tournament"}'
+        elif isinstance(instance, LeadershipHours):
+            hours = value('hours') or 0
+            summary = f'Logged {hours} leadership hour{"" if hours == 1 else "s"} at {value("event")}'
+        elif isinstance(instance, PracticalScore):
+            summary = f'Scored {value("score") or 0} on a practical test'
+        else:
+            summary = f'Promoted to {instance.rank}' if instance.rank else 'Promoted'
+        return summary if len(summary) <= 200 else Truncator(summary).chars(200)
+
+    @classmethod
+    def build(cls, instance, created=None):
+        """An unsaved event for a message, stat record or promoted profile."""
+        room = None
+        if isinstance(instance, Message):
+            user, room = instance.user, instance.room
+            created = created or instance.created
+        elif isinstance(instance, Profile):
+            user = instance.user
+        else:
+            user = instance.profile.user
+
+        return cls(
+            kind=cls.MODEL_KINDS[instance.__class__],
+            object_id=instance.pk,
+            message=instance if room else None,
+            actor=user,
+            actor_username=user.username,
+            room=room,
+            room_name=room.name if room else '',
+            summary=cls.summarize(instance),
+            created=created or timezone.now(),
+        )
+
+    @classmethod
+    def for_records(cls, records):
+        """The events of the messages or stat records in a queryset."""
+        return cls.objects.filter(kind=cls.MODEL_KINDS[records.model], object_id__in=records.values('pk'))
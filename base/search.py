@@ -0,0 +1,170 @@
+from functools import lru_cache
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q
+
+from .models import ActivityEvent, Message, Profile, Room, Topic
+
+SEARCH_CONFIG = 'english'
+
+# tsvector expressions stored on each model's search_vector column. They only
+# reference the model's own columns so a whole table can be refreshed with a
+# single UPDATE; joined names (topic, host, username) are matched by trigram
+SEARCH_VECTORS = {
+    Room: lambda: SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+                  SearchVector('description', weight='C', config=SEARCH_CONFIG),
+    Message: lambda: SearchVector('body', weight='A', config=SEARCH_CONFIG),
+    Profile: lambda: SearchVector('name', weight='A', config=SEARCH_CONFIG),
+}
+
+SEARCH_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS room_search_vector_idx ON base_room USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS message_search_vector_idx ON base_message USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS profile_search_vector_idx ON base_profile USING gin (search_vector)',
+]
+
+TRIGRAM_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS room_name_trgm_idx ON base_room USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS topic_name_trgm_idx ON base_topic USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS profile_name_trgm_idx ON base_profile USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS user_username_trgm_idx ON auth_user USING gin (username gin_trgm_ops)',
+]
+
+
+def isPostgres():
+    return connection.vendor == 'postgresql'
+
+
+@lru_cache(maxsize=None)
+def hasTrigram():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def createSearchIndexes():
+    """
+    Create the GIN indexes used by search. They are Postgres-only, so they are
+    created here rather than in model Meta to keep SQLite development working.
+    """
+    if not isPostgres():
+        return
+
+    with connection.cursor() as cursor:
+        for sql in SEARCH_INDEXES:
+            cursor.execute(sql)
+
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is not None:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for sql in TRIGRAM_INDEXES:
+                cursor.execute(sql)
+    hasTrigram.cache_clear()
+
+
+def updateSearchVector(model, pk=None):
+    """Refresh the stored search_vector of one row, or the whole table."""
+    if not isPostgres():
+        return 0
+
+    rows = model.objects.all() if pk is None else model.objects.filter(pk=pk)
+    return rows.update(search_vector=SEARCH_VECTORS[model]())
+
+
+def similar(field, q):
+    # trigram word similarity is served by the gin_trgm_ops indexes; without
+    # pg_trgm fall back to the plain substring match
+    if hasTrigram():
+        return Q(**{f'{field}__trigram_word_similar': q})
+    return Q(**{f'{field}__icontains': q})
+
+
+def searchRooms(q):
+    rooms = Room.objects.all()
+    if not q:
+        return rooms
+
+    if not isPostgres():
+        return rooms.filter(
+            Q(topic__name__icontains=q) |
+            Q(name__icontains=q) |
+            Q(description__icontains=q) |
+            Q(host__username__icontains=q)
+        )
+
+    query = SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch')
+    rank = SearchRank(F('search_vector'), query)
+    if hasTrigram():
+        rank = rank + TrigramWordSimilarity(q, 'name')
+
+    return rooms.filter(
+        Q(search_vector=query) |
+        similar('name', q) |
+        similar('topic__name', q) |
+        similar('host__username', q)
+    ).annotate(search_rank=rank).order_by('-search_rank', '-updated')
+
+
+def searchMessages(q):
+    """Messages whose body matches, or that were posted in a matching room."""
+    room_messages = Message.objects.all()
+    if not q:
+        return room_messages
+
+    if not isPostgres():
+        return room_messages.filter(
+            Q(body__icontains=q) |
+            Q(room__topic__name__icontains=q) |
+            Q(room__name__icontains=q) |
+            Q(room__description__icontains=q)
+        )
+
+    query = SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch')
+    return room_messages.filter(
+        Q(search_vector=query) |
+        Q(room__in=searchRooms(q).order_by().values('pk'))
+    )
+
+
+def searchActivity(q):
+    """The activity feed, narrowed by a search to the events of matching messages."""
+    events = ActivityEvent.objects.all()
+    if not q:
+        return events
+    return events.filter(message__in=searchMessages(q).order_by().values('pk'))
+
+
+def searchProfiles(q):
+    profiles = Profile.objects.all()
+    if not q:
+        return profiles.order_by('name')
+
+    if not isPostgres():
+        return profiles.filter(
+            Q(user__username__icontains=q) |
+            Q(name__icontains=q)
+        ).order_by('name')
+
+    query = SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch')
+    rank = SearchRank(F('search_vector'), query)
+    if hasTrigram():
+        rank = rank + TrigramWordSimilarity(q, 'name')
+
+    return profiles.filter(
+        Q(search_vector=query) |
+        similar('name', q) |
+        similar('user__username', q)
+    ).annotate(search_rank=rank).order_by('-search_rank', 'name')
+
+
+def searchTopics(q):
+    topics = Topic.objects.all()
+    if not q:
+        return topics
+
+    if not isPostgres() or not hasTrigram():
+        return topics.filter(name__icontains=q)
+
+    return topics.filter(Q(name__icontains=q) | similar('name', q)) \
+        .annotate(similarity=TrigramWordSimilarity(q, 'name')).order_by('-similarity', 'name')
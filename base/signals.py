@@ -1,7 +1,14 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_migrate, post_save
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from django.utils import timezone
+from .models import Profile, Attendance, Tournament, LeadershipHours, PracticalScore, ProgressPeriod, ProgressSummary, \
+    Room, Message, ActivityEvent, getPeriod, getRoomCounts, period_calendar, touchProfiles
+from .caching import bumpProfileVersions
+from .events import getBroker
+from .search import createSearchIndexes, updateSearchVector
 
 
 @receiver(post_save, sender=User)
@@ -11,5 +18,211 @@ def create_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+def save_profile(sender, instance, created, **kwargs):
+    # only a profile already loaded on this user can hold unsaved edits, and
+    # looking it up otherwise would cost a query on every login
+    if created or not User.profile.related.is_cached(instance):
+        return
+
+    dirty = instance.profile.get_dirty_fields()
+    if dirty:
+        instance.profile.save(update_fields=dirty)
+
+
+# ProgressSummary column kept in step with each stat model, and the field
+# whose value is added to it (None means the record counts as one)
+SUMMARY_FIELDS = {
+    Attendance: ('attendance_count', None),
+    Tournament: ('tournament_count', None),
+    LeadershipHours: ('leadership_hours_total', 'hours'),
+    PracticalScore: ('practical_score_latest', 'score'),
+}
+
+
+def get_progress_key(instance):
+    """
+    Return (profile_id, period start, period end, value) for a stat record, or None if
+    it has no profile or date. Views assign raw POST strings to these fields,
+    so values go through the model fields' to_python() first.
+    """
+    column, value_field = SUMMARY_FIELDS[instance.__class__]
+    date = instance.__dict__.get('date')
+    if instance.profile_id is None or date in (None, ''):
+        return None
+
+    date = instance._meta.get_field('date').to_python(date)
+    value = 1
+    if value_field is not None:
+        value = instance._meta.get_field(value_field).to_python(instance.__dict__.get(value_field)) or 0
+    period = getPeriod(date)
+    return (instance.profile_id, period.start, period.end, value)
+
+
+def apply_progress(model, key, sign):
+    profile_id, start, end, value = key
+    column, value_field = SUMMARY_FIELDS[model]
+    summaries = ProgressSummary.objects.filter(profile_id=profile_id, start=start)
+
+    if model is PracticalScore:
+        # the latest score cannot be derived from a delta, so recompute it
+        updated = summaries.update(practical_score_latest=ProgressSummary.latest_score(profile_id, start, end))
+    else:
+        updated = summaries.update(**{column: F(column) + sign * value})
+
+    # a missing row is built from the raw records, which already include this
+    # change; deletes never create rows so cascading profile deletes stay clean
+    if not updated and sign > 0:
+        ProgressSummary.refresh(profile_id, start, end)
+
+
+@receiver(post_init, sender=Attendance)
+@receiver(post_init, sender=Tournament)
+@receiver(post_init, sender=LeadershipHours)
+@receiver(post_init, sender=PracticalScore)
+def remember_progress(sender, instance, **kwargs):
+    instance._progress_key = get_progress_key(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_save, sender=Tournament)
+@receiver(post_save, sender=LeadershipHours)
+@receiver(post_save, sender=PracticalScore)
+def update_progress_summary(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_progress_key', None)
+    current = get_progress_key(instance)
+
+    if previous == current:
+        return
+    if previous is not None:
+        apply_progress(sender, previous, -1)
+    if current is not None:
+        apply_progress(sender, current, 1)
+    instance._progress_key = current
+    bumpProfileVersions([key[0] for key in (previous, current) if key is not None])
+    touchProfiles([key[0] for key in (previous, current) if key is not None])
+
+
+@receiver(post_delete, sender=Attendance)
+@receiver(post_delete, sender=Tournament)
+@receiver(post_delete, sender=LeadershipHours)
+@receiver(post_delete, sender=PracticalScore)
+def remove_progress_summary(sender, instance, **kwargs):
+    key = getattr(instance, '_progress_key', None) or get_progress_key(instance)
+    if key is not None:
+        apply_progress(sender, key, -1)
+        bumpProfileVersions([key[0]])
+        touchProfiles([key[0]])
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def bump_profile_version(sender, instance, **kwargs):
+    bumpProfileVersions([instance.pk])
+
+
+@receiver(post_save, sender=ProgressPeriod)
+@receiver(post_delete, sender=ProgressPeriod)
+def clear_period_calendar(sender, **kwargs):
+    period_calendar.clear()
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Profile)
+def update_search_vector(sender, instance, update_fields=None, **kwargs):
+    if sender is Profile and update_fields is not None and 'name' not in update_fields:
+        return
+    updateSearchVector(sender, instance.pk)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Attendance)
+@receiver(post_save, sender=Tournament)
+@receiver(post_save, sender=LeadershipHours)
+@receiver(post_save, sender=PracticalScore)
+def record_activity(sender, instance, created, **kwargs):
+    if created:
+        if sender is Message or instance.profile_id is not None:
+            ActivityEvent.build(instance).save()
+        return
+
+    # an edit changes what the event says, not who did it or when
+    summary = ActivityEvent.summarize(instance)
+    ActivityEvent.objects.filter(kind=ActivityEvent.MODEL_KINDS[sender], object_id=instance.pk) \
+        .exclude(summary=summary).update(summary=summary)
+
+
+@receiver(post_delete, sender=Attendance)
+@receiver(post_delete, sender=Tournament)
+@receiver(post_delete, sender=LeadershipHours)
+@receiver(post_delete, sender=PracticalScore)
+def remove_activity(sender, instance, **kwargs):
+    # message events go with their message through the foreign key
+    ActivityEvent.objects.filter(kind=ActivityEvent.MODEL_KINDS[sender], object_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Profile)
+def record_promotion(sender, instance, created, **kwargs):
+    # Profile.save() only resets what it loaded once the signals have run;
+    # a profile built in memory has nothing to compare its rank with
+    loaded = getattr(instance, '_loaded_values', None)
+    if not created and loaded is not None and {'rank', 'last_promoted'} & instance.get_dirty_fields():
+        ActivityEvent.build(instance).save()
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def count_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Recount participant_count after participants.add(), remove(), set() or
+    clear() from either side, as the admin does. The room view writes the
+    join table directly and counts the join itself, so it does not come
+    through here.
+    """
+    if action == 'pre_clear' and reverse:
+        # the user's rooms are gone from the join table once it is cleared
+        instance._cleared_rooms = list(instance.participants.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear') or (action != 'post_clear' and not pk_set):
+        return
+
+    if not reverse:
+        room_ids = [instance.pk]
+    elif action == 'post_clear':
+        room_ids = instance.__dict__.pop('_cleared_rooms', [])
+    else:
+        room_ids = pk_set
+    Room.objects.filter(id__in=room_ids).update(participant_count=getRoomCounts()['participant_count'])
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    # read from __dict__ so a deferred username is not fetched
+    instance._loaded_username = instance.__dict__.get('username')
+
+
+@receiver(post_save, sender=User)
+def rename_user(sender, instance, created, **kwargs):
+    # the feed copies usernames, and the profile pages and navbar show them
+    if created or instance.username == instance._loaded_username:
+        return
+    instance._loaded_username = instance.username
+    ActivityEvent.objects.filter(actor=instance).update(actor_username=instance.username)
+    Profile.objects.filter(user=instance).update(last_changed=timezone.now())
+
+
+@receiver(post_save, sender=Room)
+def rename_room(sender, instance, created, **kwargs):
+    if not created:
+        ActivityEvent.objects.filter(room=instance).exclude(room_name=instance.name).update(room_name=instance.name)
+
+
+@receiver(post_save, sender=Message)
+def publish_message(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: getBroker().publish(instance.room_id, instance.id))
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, **kwargs):
+    if sender.name == 'base':
+        createSearchIndexes()
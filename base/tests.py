@@ -1,3 +1,1179 @@
-from django.test import TestCase
+import asyncio
+import cProfile
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models.query import QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.backends.django import Template
+from django.template.loader import render_to_string
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import async_views, views
+from .caching import getVersionKey, getVersions
+from .events import PollingBroker
+from .export import EXPORT_COLUMNS
+from .images import PICTURE_FORMATS, PICTURE_SIZES, processPicture
+from .management.commands import import_progress
+from .middleware import ProfilerMiddleware, RequestTimingMiddleware
+from .models import Profile, Attendance, Tournament, LeadershipHours, PracticalScore, ProgressPeriod, Message, Room, \
+    Topic, ProgressSummary, ActivityEvent, getCurrentPeriod, getPeriod, getQuarterRange, getPeriodFilter, period_calendar
+
+
+class PeriodRangeTests(TestCase):
+    def test_quarter_ranges_are_half_open(self):
+        self.assertEqual(getQuarterRange(2023, 1), (datetime.date(2023, 1, 1), datetime.date(2023, 4, 1)))
+        self.assertEqual(getQuarterRange(2023, 4), (datetime.date(2023, 10, 1), datetime.date(2024, 1, 1)))
+
+    def test_period_filter_excludes_end(self):
+        user = User.objects.create(username='student')
+        start, end = getQuarterRange(2023, 2)
+        Attendance.objects.create(profile=user.profile, date=start)
+        Attendance.objects.create(profile=user.profile, date=end - datetime.timedelta(days=1))
+        Attendance.objects.create(profile=user.profile, date=end)
+
+        self.assertEqual(Attendance.objects.filter(**getPeriodFilter(start, end)).count(), 2)
+
+
+class ProgressPeriodTests(TestCase):
+    def setUp(self):
+        # rolled back rows do not send post_delete, so reset the calendar
+        period_calendar.clear()
+        self.addCleanup(period_calendar.clear)
+
+    def test_configured_period_is_used(self):
+        cycle = ProgressPeriod.objects.create(name='Spring cycle', start=datetime.date(2023, 2, 15),
+                                              end=datetime.date(2023, 6, 15))
+
+        self.assertEqual(getPeriod(datetime.date(2023, 2, 15)), cycle)
+        self.assertEqual(getPeriod(datetime.date(2023, 6, 14)), cycle)
+
+    def test_uncovered_dates_fall_back_to_calendar_quarters(self):
+        ProgressPeriod.objects.create(name='Spring cycle', start=datetime.date(2023, 2, 15),
+                                      end=datetime.date(2023, 6, 15))
+        ProgressPeriod.objects.create(name='Winter cycle', start=datetime.date(2023, 11, 1),
+                                      end=datetime.date(2024, 2, 1))
+
+        # quarters are clipped to the gaps between the configured periods
+        ranges = [(period.start, period.end) for period in
+                  map(getPeriod, [datetime.date(2023, 1, 10), datetime.date(2023, 3, 1),
+                                  datetime.date(2023, 6, 15), datetime.date(2023, 8, 1),
+                                  datetime.date(2023, 10, 31), datetime.date(2024, 2, 1)])]
+        self.assertEqual(ranges, [
+            (datetime.date(2023, 1, 1), datetime.date(2023, 2, 15)),
+            (datetime.date(2023, 2, 15), datetime.date(2023, 6, 15)),
+            (datetime.date(2023, 6, 15), datetime.date(2023, 7, 1)),
+            getQuarterRange(2023, 3),
+            (datetime.date(2023, 10, 1), datetime.date(2023, 11, 1)),
+            (datetime.date(2024, 2, 1), datetime.date(2024, 4, 1)),
+        ])
+
+    def test_uncovered_dates_are_not_counted_twice(self):
+        ProgressPeriod.objects.create(name='Spring cycle', start=datetime.date(2023, 2, 15),
+                                      end=datetime.date(2023, 6, 15))
+        profile = User.objects.create_user('student').profile
+        Attendance.objects.create(profile=profile, date=datetime.date(2023, 1, 10))
+        Attendance.objects.create(profile=profile, date=datetime.date(2023, 3, 1))
+
+        counts = {(summary.start, summary.end): summary.attendance_count for summary in ProgressSummary.objects.all()}
+        self.assertEqual(counts, {(datetime.date(2023, 1, 1), datetime.date(2023, 2, 15)): 1,
+                                  (datetime.date(2023, 2, 15), datetime.date(2023, 6, 15)): 1})
+        call_command('rebuild_progress_summary', check=True, stdout=io.StringIO())
+
+        with mock.patch('base.models.timezone.localdate', return_value=datetime.date(2023, 1, 20)):
+            period_calendar.clear()
+            self.assertEqual(profile.get_recent_attendances().count(), 1)
+
+    def test_lookups_are_cached(self):
+        getPeriod(datetime.date(2023, 1, 1))
+        with self.assertNumQueries(0):
+            getPeriod(datetime.date(2023, 5, 1))
+
+
+class ProgressSummarySignalTests(TestCase):
+    WINTER = datetime.date(2023, 2, 10)
+    SPRING = datetime.date(2023, 5, 10)
+
+    def setUp(self):
+        period_calendar.clear()
+        self.addCleanup(period_calendar.clear)
+        self.first = User.objects.create_user('first').profile
+        self.second = User.objects.create_user('second').profile
+
+    def assertSummariesMatchRecords(self):
+        for summary in ProgressSummary.objects.all():
+            actual = {column: getattr(summary, column) for column in ProgressSummary.METRICS}
+            self.assertEqual(actual, ProgressSummary.compute(summary.profile_id, summary.start, summary.end),
+                             str(summary))
+        call_command('rebuild_progress_summary', check=True, stdout=io.StringIO())
+
+    def getSummary(self, profile, date):
+        period = getPeriod(date)
+        return ProgressSummary.objects.get(profile=profile, start=period.start)
+
+    def test_moving_a_record_between_periods(self):
+        hours = LeadershipHours.objects.create(profile=self.first, date=self.WINTER, event='Class', hours=3)
+        Attendance.objects.create(profile=self.first, date=self.WINTER)
+        attendance = Attendance.objects.get()
+        # views assign the raw POST strings
+        attendance.date = str(self.SPRING)
+        attendance.save()
+        hours.date = self.SPRING
+        hours.hours = 5
+        hours.save()
+
+        self.assertSummariesMatchRecords()
+        self.assertEqual(self.getSummary(self.first, self.WINTER).attendance_count, 0)
+        self.assertEqual(self.getSummary(self.first, self.SPRING).attendance_count, 1)
+        self.assertEqual(self.getSummary(self.first, self.SPRING).leadership_hours_total, 5)
+
+    def test_moving_a_record_between_profiles(self):
+        Tournament.objects.create(profile=self.first, date=self.WINTER, event='Open')
+        tournament = Tournament.objects.get()
+        tournament.profile = self.second
+        tournament.save()
+
+        self.assertSummariesMatchRecords()
+        self.assertEqual(self.getSummary(self.first, self.WINTER).tournament_count, 0)
+        self.assertEqual(self.getSummary(self.second, self.WINTER).tournament_count, 1)
+
+    def test_deleting_a_record(self):
+        Attendance.objects.create(profile=self.first, date=self.WINTER)
+        Attendance.objects.create(profile=self.first, date=self.WINTER + datetime.timedelta(days=1))
+        LeadershipHours.objects.create(profile=self.first, date=self.WINTER, event='Class', hours=2)
+        Attendance.objects.first().delete()
+        LeadershipHours.objects.get().delete()
+
+        self.assertSummariesMatchRecords()
+        summary = self.getSummary(self.first, self.WINTER)
+        self.assertEqual((summary.attendance_count, summary.leadership_hours_total), (1, 0))
+
+    def test_deleting_a_profile_cascades(self):
+        for profile in (self.first, self.second):
+            Attendance.objects.create(profile=profile, date=self.WINTER)
+            PracticalScore.objects.create(profile=profile, date=self.SPRING, score=70)
+        self.first.user.delete()
+
+        self.assertSummariesMatchRecords()
+        self.assertFalse(ProgressSummary.objects.filter(profile_id=self.first.id).exists())
+        self.assertEqual(self.getSummary(self.second, self.WINTER).attendance_count, 1)
+
+    def test_latest_practical_score_is_recomputed(self):
+        PracticalScore.objects.create(profile=self.first, date=self.WINTER, score=60)
+        latest = PracticalScore.objects.create(profile=self.first, date=self.WINTER + datetime.timedelta(days=7),
+                                               score=90)
+        self.assertEqual(self.getSummary(self.first, self.WINTER).practical_score_latest, 90)
+
+        latest.date = self.SPRING
+        latest.save()
+        self.assertSummariesMatchRecords()
+        self.assertEqual(self.getSummary(self.first, self.WINTER).practical_score_latest, 60)
+
+        PracticalScore.objects.filter(score=60).get().delete()
+        latest.delete()
+        self.assertSummariesMatchRecords()
+        self.assertEqual(self.getSummary(self.first, self.WINTER).practical_score_latest, 0)
+        self.assertEqual(self.getSummary(self.first, self.SPRING).practical_score_latest, 0)
+
+    def test_roster_annotation_matches_the_records(self):
+        period = getCurrentPeriod()
+        earlier = period.start - datetime.timedelta(days=1)
+        for date in (period.start, earlier):
+            Attendance.objects.create(profile=self.first, date=date)
+            Tournament.objects.create(profile=self.first, date=date, event='Open')
+            LeadershipHours.objects.create(profile=self.first, date=date, event='Class', hours=4)
+            PracticalScore.objects.create(profile=self.first, date=date, score=80 if date == earlier else 75)
+        Attendance.objects.create(profile=self.second, date=earlier)
+
+        for profile in Profile.objects.with_current_progress():
+            with self.subTest(profile=profile.name):
+                annotated = {column: getattr(profile, column) for column in ProgressSummary.METRICS}
+                self.assertEqual(annotated, ProgressSummary.compute(profile.id, period.start, period.end))
+        self.assertEqual(Profile.objects.with_current_progress().get(pk=self.first.pk).practical_score_latest, 75)
+
+
+class ProfileDateIndexTests(TestCase):
+    PROFILES = 50
+    RECORDS_PER_PROFILE = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create skips the profile and progress summary signals, which
+        # keeps generating the synthetic dataset fast
+        User.objects.bulk_create([User(username=f'student{i}') for i in range(cls.PROFILES)])
+        Profile.objects.bulk_create([Profile(user=user, name=user.username) for user in User.objects.all()])
+
+        rng = random.Random(0)
+        first_day = datetime.date(2018, 1, 1)
+        profiles = list(Profile.objects.all())
+        for model, extra in [(Attendance, {}),
+                             (Tournament, {'event': 'Open'}),
+                             (LeadershipHours, {'event': 'Class', 'hours': 1}),
+                             (PracticalScore, {'score': 80})]:
+            model.objects.bulk_create(
+                [model(profile=profile, date=first_day + datetime.timedelta(days=day), **extra)
+                 for profile in profiles for day in rng.sample(range(5000), cls.RECORDS_PER_PROFILE)],
+                batch_size=2000
+            )
+        cls.profile = profiles[0]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_quarter_queries_use_profile_date_index(self):
+        start, end = getQuarterRange(2020, 3)
+        for model in [Attendance, Tournament, LeadershipHours, PracticalScore]:
+            with self.subTest(model=model.__name__):
+                plan = model.objects.filter(profile=self.profile, **getPeriodFilter(start, end)).explain()
+                # the date range must be part of the index condition (Postgres
+                # "Index Cond", SQLite "USING INDEX ... (profile_id=? AND date>?...")
+                # rather than a filter applied to every row of the profile
+                self.assertRegex(plan, r'Index Cond: .*profile_id = \d+\) AND \(date >=|'
+                                       r'USING (COVERING )?INDEX \w+ \(profile_id=\? AND date>\?')
+
+
+class ProgressApiTests(TestCase):
+    PROFILES = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([User(username=f'student{i}') for i in range(cls.PROFILES)])
+        Profile.objects.bulk_create([Profile(user=user, name=user.username) for user in User.objects.all()])
+
+        period = getCurrentPeriod()
+        profiles = list(Profile.objects.all())
+        ProgressSummary.objects.bulk_create([
+            ProgressSummary(profile=profile, start=period.start, end=period.end, attendance_count=i)
+            for i, profile in enumerate(profiles)
+        ])
+        Attendance.objects.bulk_create([Attendance(profile=profile, date=period.start) for profile in profiles])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(username='student0'))
+
+    def assertPagesTakeOneQuery(self, url):
+        results = []
+        while url:
+            with self.assertNumQueries(1):
+                page = self.client.get(url).json()
+            results.extend(page['results'])
+            url = page['next']
+        return results
+
+    def test_profile_pages_with_progress_take_one_query(self):
+        results = self.assertPagesTakeOneQuery('/api/profiles/?page_size=100')
+
+        self.assertEqual(len(results), self.PROFILES)
+        self.assertEqual(sorted(profile['attendance_count'] for profile in results), list(range(self.PROFILES)))
+
+    def test_record_pages_take_one_query(self):
+        results = self.assertPagesTakeOneQuery('/api/attendances/?period=current&page_size=200')
+
+        self.assertEqual(len(results), self.PROFILES)
+        self.assertTrue(results[0]['username'].startswith('student'))
+
+    def test_sparse_fields(self):
+        page = self.client.get('/api/profiles/?fields=id,name,attendance_count').json()
+
+        self.assertEqual(set(page['results'][0]), {'id', 'name', 'attendance_count'})
+
+
+class BulkAttendanceTests(TestCase):
+    DATE = datetime.date(2023, 2, 10)
+
+    def setUp(self):
+        self.profiles = [User.objects.create_user(f'student{i}').profile for i in range(3)]
+        self.ids = [profile.id for profile in self.profiles]
+        self.client = APIClient()
+
+    def test_check_in_skips_students_already_checked_in(self):
+        Attendance.check_in(self.DATE, self.ids[:2])
+        summaries = Attendance.check_in(self.DATE, self.ids)
+
+        self.assertEqual(Attendance.objects.filter(date=self.DATE).count(), 3)
+        self.assertEqual(ActivityEvent.objects.filter(kind=ActivityEvent.ATTENDANCE).count(), 3)
+        self.assertEqual({profile_id: summary.attendance_count for profile_id, summary in summaries.items()},
+                         dict.fromkeys(self.ids, 1))
+        call_command('rebuild_progress_summary', check=True, stdout=io.StringIO())
+
+    def test_check_in_is_all_or_nothing(self):
+        with mock.patch.object(ProgressSummary, 'refresh_many', side_effect=RuntimeError('connection lost')), \
+                self.assertRaises(RuntimeError):
+            Attendance.check_in(self.DATE, self.ids)
+
+        self.assertFalse(Attendance.objects.exists())
+        self.assertFalse(ActivityEvent.objects.exists())
+
+    def test_attendance_is_unique_per_day(self):
+        Attendance.objects.create(profile=self.profiles[0], date=self.DATE)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Attendance.objects.create(profile=self.profiles[0], date=self.DATE)
+
+    def test_bulk_endpoint_is_superuser_only(self):
+        self.client.force_authenticate(self.profiles[0].user)
+        response = self.client.post('/api/attendances/bulk/', {'date': self.DATE, 'profiles': self.ids}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_bulk_endpoint_returns_summaries(self):
+        self.client.force_authenticate(User.objects.create_superuser('coach'))
+        Attendance.objects.create(profile=self.profiles[0], date=self.DATE - datetime.timedelta(days=1))
+
+        response = self.client.post('/api/attendances/bulk/', {'date': self.DATE, 'profiles': self.ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(profile['id'], profile['attendance_count']) for profile in response.json()['profiles']],
+                         [(self.ids[0], 2), (self.ids[1], 1), (self.ids[2], 1)])
+
+        # checking the same students in again changes nothing
+        response = self.client.post('/api/attendances/bulk/', {'date': self.DATE, 'profiles': self.ids}, format='json')
+        self.assertEqual([profile['attendance_count'] for profile in response.json()['profiles']], [2, 1, 1])
+        self.assertEqual(Attendance.objects.count(), 4)
+
+    def test_bulk_endpoint_rejects_unknown_profiles(self):
+        self.client.force_authenticate(User.objects.create_superuser('coach'))
+        response = self.client.post('/api/attendances/bulk/', {'date': self.DATE, 'profiles': [self.ids[0], 0]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'profiles': ['Unknown profile 0.']})
+        self.assertFalse(Attendance.objects.exists())
+
+
+class ImportProgressTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'progress.csv')
+        self.profile = User.objects.create_user('student').profile
+
+    def writeRows(self, *dates, username='student'):
+        with open(self.path, 'w') as f:
+            f.write('username,type,date\n')
+            for date in dates:
+                f.write(f'{username},attendance,{date}\n')
+
+    def importRows(self, *args):
+        out = io.StringIO()
+        call_command('import_progress', self.path, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_duplicates_are_not_counted_as_inserted(self):
+        Attendance.objects.create(profile=self.profile, date=datetime.date(2023, 2, 1))
+        self.writeRows('2023-02-01', '2023-02-02', '2023-02-02', '2023-02-03')
+
+        output = self.importRows('--batch-size', '2')
+        self.assertIn('Imported 2 records (2 duplicates, 0 rejected)', output)
+        self.assertEqual(Attendance.objects.count(), 3)
+
+    def test_imported_records_join_the_activity_feed(self):
+        Attendance.objects.create(profile=self.profile, date=datetime.date(2023, 2, 1))
+        self.writeRows('2023-02-01', '2023-02-02')
+        self.importRows()
+
+        imported = Attendance.objects.get(date=datetime.date(2023, 2, 2))
+        event = ActivityEvent.objects.get(kind=ActivityEvent.ATTENDANCE, object_id=imported.id)
+        self.assertEqual((event.actor_id, event.summary), (self.profile.user_id, 'Checked in for class'))
+        self.assertEqual(timezone.localtime(event.created).date(), imported.date)
+        self.assertEqual(ActivityEvent.objects.filter(kind=ActivityEvent.ATTENDANCE).count(), 2)
+
+    def test_rows_written_by_others_during_the_import_are_not_counted(self):
+        other = User.objects.create_user('other').profile
+        with open(self.path, 'w') as f:
+            f.write('username,type,date,event\n'
+                    'student,attendance,2023-02-01,\n'
+                    'student,tournament,2023-02-04,Spring Open\n')
+        bulk_create = QuerySet.bulk_create
+
+        def with_other_writes(queryset, objs, *args, **kwargs):
+            # an instructor's entries landing alongside the batch
+            if queryset.model is Attendance:
+                Attendance.objects.create(profile=other, date=datetime.date(2023, 2, 1))
+            elif queryset.model is Tournament:
+                Tournament.objects.create(profile=other, event='Winter Cup', date=datetime.date(2023, 2, 4))
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', with_other_writes):
+            output = self.importRows()
+
+        self.assertIn('Imported 2 records (0 duplicates, 0 rejected)', output)
+        for model, kind in [(Attendance, ActivityEvent.ATTENDANCE), (Tournament, ActivityEvent.TOURNAMENT)]:
+            events = ActivityEvent.objects.filter(kind=kind)
+            self.assertEqual(sorted(events.values_list('object_id', 'actor_id')),
+                             sorted(model.objects.values_list('id', 'profile__user_id')))
+
+    def test_imported_records_change_the_profile_etag(self):
+        self.client.force_login(self.profile.user)
+        path = f'/profile/{self.profile.id}/attendances/'
+        response = self.client.get(path)
+
+        self.writeRows('2023-02-01')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importRows()
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Feb. 1, 2023')
+
+    def test_resume_continues_after_the_checkpoint(self):
+        self.writeRows('2023-02-01', '2023-02-02', '2023-02-03', '2023-02-04', '2023-02-05')
+        insert = import_progress.Command.insert
+
+        def fail_on_third_batch(command, batch):
+            if batch[0][0] > 5:
+                raise RuntimeError('connection lost')
+            return insert(command, batch)
+
+        with mock.patch.object(import_progress.Command, 'insert', fail_on_third_batch), \
+                self.assertRaises(RuntimeError):
+            self.importRows('--batch-size', '2')
+        with open(f'{self.path}.checkpoint') as f:
+            self.assertEqual(json.load(f), {'line': 5, 'inserted': 4, 'skipped': 0, 'rejected': 0})
+
+        output = self.importRows('--batch-size', '2', '--resume')
+        self.assertIn('Resuming after line 5.', output)
+        self.assertIn('Imported 5 records', output)
+        self.assertEqual(Attendance.objects.count(), 5)
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+        call_command('rebuild_progress_summary', check=True, stdout=io.StringIO())
+
+    def test_rejected_rows_go_to_the_error_file(self):
+        errors_path = os.path.join(os.path.dirname(self.path), 'errors.jsonl')
+        with open(self.path, 'w') as f:
+            f.write('username,type,date\nstudent,attendance,2023-02-01\nnobody,attendance,2023-02-02\n'
+                    'student,attendance,not a date\nstudent,award,2023-02-03\n')
+
+        output = self.importRows('--errors', errors_path)
+        self.assertIn('Imported 1 records (0 duplicates, 3 rejected)', output)
+        with open(errors_path) as f:
+            errors = [json.loads(line) for line in f]
+        self.assertEqual([(error['line'], sorted(error['errors'])) for error in errors],
+                         [(3, ['username']), (4, ['date']), (5, ['type'])])
+        self.assertEqual(errors[0]['row']['username'], 'nobody')
+
+
+class ExportProgressTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user('student').profile
+        self.client.force_login(self.profile.user)
+        Attendance.objects.create(profile=self.profile, date=datetime.date(2023, 2, 1))
+        # a comma, quotes and a line break the CSV writer has to escape
+        Tournament.objects.create(profile=self.profile, event='Open, "Spring"\nDay 2', date=datetime.date(2023, 2, 4))
+        LeadershipHours.objects.create(profile=self.profile, event='Class', hours=3, date=datetime.date(2023, 2, 5))
+        PracticalScore.objects.create(profile=self.profile, score=85, date=datetime.date(2023, 2, 6))
+        # another student's record, which the profile export leaves out
+        Attendance.objects.create(profile=User.objects.create_user('other').profile, date=datetime.date(2023, 2, 1))
+        self.expected = [
+            {'type': 'attendance', 'username': 'student', 'name': 'student', 'date': '2023-02-01'},
+            {'type': 'tournament', 'username': 'student', 'name': 'student', 'date': '2023-02-04',
+             'event': 'Open, "Spring"\nDay 2'},
+            {'type': 'leadership_hours', 'username': 'student', 'name': 'student', 'date': '2023-02-05',
+             'event': 'Class', 'hours': 3},
+            {'type': 'practical_score', 'username': 'student', 'name': 'student', 'date': '2023-02-06', 'score': 85},
+        ]
+
+    def readCsv(self, text):
+        reader = csv.DictReader(io.StringIO(text))
+        self.assertEqual(reader.fieldnames, EXPORT_COLUMNS)
+        # CSV has no types, and empty cells stand for the columns a record lacks
+        return [{column: value for column, value in row.items() if value} for row in reader]
+
+    def asText(self, rows):
+        return [{column: str(value) for column, value in row.items()} for row in rows]
+
+    def test_view_streams_csv(self):
+        response = self.client.get(f'/profile/{self.profile.id}/export/')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="student.csv"')
+        self.assertEqual(self.readCsv(b''.join(response.streaming_content).decode()), self.asText(self.expected))
+
+    def test_view_streams_jsonl(self):
+        response = self.client.get(f'/profile/{self.profile.id}/export/?format=jsonl&period=2023-02-01')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected)
+
+    def test_view_is_limited_to_your_own_profile(self):
+        other = Profile.objects.get(user__username='other')
+        response = self.client.get(f'/profile/{other.id}/export/')
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        self.assertContains(response, 'Users can only export their own progress.')
+
+    def test_command_writes_each_format(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(format=fmt):
+                path = os.path.join(directory.name, f'progress.{fmt}')
+                out = io.StringIO()
+                call_command('export_progress', '--format', fmt, '--username', 'student', '--output', path,
+                             stdout=out)
+                self.assertIn('Exported 4 records', out.getvalue())
+
+                with open(path, newline='', encoding='utf-8') as f:
+                    text = f.read()
+                if fmt == 'csv':
+                    self.assertEqual(self.readCsv(text), self.asText(self.expected))
+                else:
+                    self.assertEqual([json.loads(line) for line in text.splitlines()], self.expected)
+
+
+class GenerateAcademyTests(TestCase):
+    def generate(self, *args):
+        call_command('generate_academy', '--profiles', 3, '--years', 1, '--rooms', 2, '--messages', 5, *args,
+                     stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_a_second_run_needs_clear(self):
+        self.generate()
+        with self.assertRaisesMessage(CommandError, 'Pass --clear'):
+            self.generate()
+        self.assertEqual(User.objects.filter(username__startswith='academy_').count(), 4)
+
+        self.generate('--clear')
+        self.assertEqual(Profile.objects.filter(user__username__startswith='academy_').count(), 4)
+
+
+class StatAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('coach'))
+        self.student = User.objects.create_user('student').profile
+        self.other = User.objects.create_user('other').profile
+        self.period = getCurrentPeriod()
+        self.tournaments = [Tournament.objects.create(profile=self.student, event=event, date=self.period.start)
+                            for event in ('Spring Open', 'Winter Cup')]
+        Tournament.objects.create(profile=self.student, event='Fall Invitational', date=self.period.start)
+
+    def applyAction(self, action, **data):
+        return self.client.post('/admin/base/tournament/', {
+            'action': action, 'index': 0, 'apply': 1,
+            '_selected_action': [tournament.id for tournament in self.tournaments], **data,
+        })
+
+    def assertCounts(self, student, other):
+        call_command('rebuild_progress_summary', check=True, stdout=io.StringIO())
+        summaries = ProgressSummary.objects.filter(start=self.period.start)
+        self.assertEqual(dict(summaries.values_list('profile_id', 'tournament_count')),
+                         {self.student.id: student, self.other.id: other})
+        events = ActivityEvent.objects.filter(kind=ActivityEvent.TOURNAMENT)
+        self.assertEqual(sorted(events.values_list('object_id', 'actor_username')),
+                         sorted(Tournament.objects.values_list('id', 'profile__user__username')))
+
+    def test_reassign_and_delete_keep_summaries_and_feed(self):
+        self.applyAction('reassign_records', username='other')
+        self.assertEqual(Tournament.objects.filter(profile=self.other).count(), 2)
+        self.assertCounts(student=1, other=2)
+
+        self.applyAction('delete_records')
+        self.assertEqual(list(Tournament.objects.values_list('event', flat=True)), ['Fall Invitational'])
+        self.assertCounts(student=1, other=0)
+
+
+class LoginProfileSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='kicks-and-punches')
+        # an uploaded picture, which Profile.save used to reopen with PIL
+        Profile.objects.filter(user=self.user).update(picture='profile_pictures/student.jpg')
+
+    def test_login_does_not_touch_the_profile(self):
+        with mock.patch('base.images.Image.open') as image_open, \
+                mock.patch('django.core.files.storage.FileSystemStorage.open') as storage_open, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/login/', {'username': 'student', 'password': 'kicks-and-punches'})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        sql = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        # the user lookup, the last_login UPDATE and three for the new session
+        self.assertEqual(len(sql), 5, sql)
+        self.assertFalse([statement for statement in sql if 'base_profile' in statement])
+        self.assertEqual(image_open.call_count + storage_open.call_count, 0)
+
+    def test_user_save_writes_changed_profile_fields(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        user.profile.name = 'Renamed'
+
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+
+        self.assertEqual(Profile.objects.get(user=user).name, 'Renamed')
+        # on Postgres the name change also refreshes the search vector
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE "base_profile"') and 'search_vector' not in query['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"name"', updates[0])
+        self.assertNotIn('"picture"', updates[0])
+        self.assertEqual(user.profile.get_dirty_fields(), set())
+
+
+class ProfileDirtyFieldTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user('student').profile
+
+    def test_values_changed_in_place_are_dirty(self):
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.picture_variants['source'] = 'profile_pictures/student.jpg'
+        profile.picture.name = 'profile_pictures/student.jpg'
+        self.assertEqual(profile.get_dirty_fields(), {'picture', 'picture_variants'})
+
+        with mock.patch('base.models.schedulePicture'):
+            profile.save()
+        profile.picture_variants['small'] = {}
+        self.assertEqual(profile.get_dirty_fields(), {'picture_variants'})
+
+    def test_saving_a_profile_built_in_memory_records_no_promotion(self):
+        profile = Profile(pk=self.profile.pk, user=self.profile.user, name='student', rank=Profile.RED)
+        with mock.patch('base.models.schedulePicture'):
+            profile.save()
+
+        self.assertEqual(Profile.objects.get(pk=profile.pk).rank, Profile.RED)
+        self.assertFalse(ActivityEvent.objects.filter(kind=ActivityEvent.PROMOTION).exists())
+
+
+class ProfilePictureTests(TestCase):
+    def test_default_avatar_is_served_with_debug_off(self):
+        user = User.objects.create_user('student')
+
+        with override_settings(DEBUG=False):
+            response = self.client.get(f'/profile/{user.id}')
+            url = re.search(r'<picture>\s*<img src="([^"]+)"', response.content.decode())[1]
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(url, '/static/images/default.svg')
+
+    def test_processing_writes_the_variants_and_recaches_the_cards(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profile = User.objects.create_user('student').profile
+        buffer = io.BytesIO()
+        Image.new('RGBA', (600, 400), 'orangered').save(buffer, 'PNG')
+
+        with override_settings(MEDIA_ROOT=directory.name):
+            name = default_storage.save('profile_pictures/student.png', ContentFile(buffer.getvalue()))
+            # as the upload leaves it, with the variants still to be made
+            Profile.objects.filter(pk=profile.pk).update(picture=name)
+            version_key = getVersionKey(profile.pk)
+            before = getVersions([version_key])[version_key]
+
+            # the pool thread closes its connections, which would end the test's transaction
+            with mock.patch('base.images.close_old_connections'), self.captureOnCommitCallbacks(execute=True):
+                processPicture(profile.pk)
+
+            profile = Profile.objects.get(pk=profile.pk)
+            self.assertEqual(profile.picture_variants['source'], name)
+            for size, pixels in PICTURE_SIZES.items():
+                for fmt, variant_name in profile.picture_variants[size].items():
+                    with self.subTest(size=size, format=fmt), default_storage.open(variant_name) as f:
+                        variant = Image.open(f)
+                        self.assertEqual((variant.format, variant.size), (fmt.upper(), (pixels, pixels * 2 // 3)))
+                self.assertEqual(set(profile.picture_variants[size]), set(PICTURE_FORMATS))
+
+            self.assertTrue(profile.small_picture.webp)
+            self.assertNotEqual(getVersions([version_key])[version_key], before)
+
+
+class AsyncViewTests(TransactionTestCase):
+    # the async views query from worker threads, which only see committed rows
+
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        profile = Profile.objects.get(user=self.user)
+        period = getCurrentPeriod()
+        Attendance.objects.create(profile=profile, date=period.start)
+        Tournament.objects.create(profile=profile, event='Spring Open', date=period.start)
+        self.profile = profile
+
+    def getResponses(self, view, path):
+        sync_request = RequestFactory().get(path)
+        async_request = AsyncRequestFactory().get(path)
+        for request in (sync_request, async_request):
+            request.user = self.user
+            request.resolver_match = resolve(path)
+        args = resolve(path).kwargs
+        return getattr(views, view)(sync_request, **args), async_to_sync(getattr(async_views, view))(async_request, **args)
+
+    def test_pages_match_the_sync_views(self):
+        for view, path in [('userProfile', f'/profile/{self.user.id}'),
+                           ('statsPage', f'/profile/{self.profile.id}/attendances/'),
+                           ('statsPage', f'/profile/{self.profile.id}/tournaments/'),
+                           ('activityPage', '/activity/')]:
+            with self.subTest(path=path):
+                sync_response, async_response = self.getResponses(view, path)
+                self.assertEqual(async_response.status_code, 200)
+                self.assertEqual(async_response.content, sync_response.content)
+
+    def test_pages_answer_revalidation_with_304(self):
+        path = f'/profile/{self.profile.id}/attendances/'
+        sync_response, async_response = self.getResponses('statsPage', path)
+        self.assertEqual(async_response['ETag'], sync_response['ETag'])
+
+        request = AsyncRequestFactory().get(path)
+        request.META['HTTP_IF_NONE_MATCH'] = async_response['ETag']
+        request.user = self.user
+        request.resolver_match = resolve(path)
+        response = async_to_sync(async_views.statsPage)(request, pk=self.profile.id)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], sync_response['Cache-Control'])
+
+    def test_stats_page_requires_login(self):
+        request = AsyncRequestFactory().get(f'/profile/{self.profile.id}/attendances/')
+        request.user = AnonymousUser()
+
+        response = async_to_sync(async_views.statsPage)(request, pk=self.profile.id)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/login/'))
+
+
+class RequestTimingTests(TransactionTestCase):
+    # like the async views, these follow queries onto other threads
+
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.profile = Profile.objects.get(user=self.user)
+        Attendance.objects.create(profile=self.profile, date=getCurrentPeriod().start)
+
+    def getQueryCount(self, response):
+        return int(re.search(r'desc="(\d+) queries', response['Server-Timing'])[1])
+
+    def test_middlewares_follow_the_chain_they_are_in(self):
+        async def respond(request):
+            return HttpResponse()
+
+        for middleware_class in (RequestTimingMiddleware, ProfilerMiddleware):
+            with self.subTest(middleware=middleware_class.__name__):
+                self.assertTrue(asyncio.iscoroutinefunction(middleware_class(respond)))
+                self.assertFalse(asyncio.iscoroutinefunction(middleware_class(lambda request: HttpResponse())))
+
+    def test_templates_are_only_timed_during_requests(self):
+        render = Template.render
+        wrapped = []
+
+        def view(request):
+            wrapped.append(Template.render is not render)
+            return HttpResponse(render_to_string('base/room_message_list.html', {'room_messages': []}))
+
+        response = RequestTimingMiddleware(view)(RequestFactory().get('/'))
+
+        self.assertEqual(wrapped, [True])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        # put back once the request is done, so other renders run unpatched
+        self.assertIs(Template.render, render)
+
+    def test_profiler_prune_tolerates_files_removed_by_another_worker(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for name in ('1-old.prof', '2-old.prof'):
+            open(os.path.join(directory.name, name), 'w').close()
+        remove = os.remove
+
+        def removed_first(path):
+            # the other worker got there first
+            remove(path)
+            remove(path)
+
+        with override_settings(PROFILER={'DIR': directory.name, 'KEEP': 1}), \
+                mock.patch('base.middleware.os.remove', removed_first):
+            request = RequestFactory().get('/')
+            request.resolver_match = None
+            path = ProfilerMiddleware(lambda request: HttpResponse()).save(cProfile.Profile(), request)
+
+        self.assertEqual(os.listdir(directory.name), [os.path.basename(path)])
+
+    def test_async_views_count_the_queries_of_their_pool_threads(self):
+        path = f'/profile/{self.profile.id}/attendances/'
+
+        async def view(request):
+            return await async_views.statsPage(request, pk=self.profile.id)
+
+        request = AsyncRequestFactory().get(path)
+        request.user = self.user
+        request.resolver_match = resolve(path)
+        middleware = RequestTimingMiddleware(view)
+
+        async def handle():
+            return await middleware(request)
+        response = async_to_sync(handle)()
+
+        # the ETag check, the profile with its user and the records, each run
+        # on a pool thread
+        self.assertEqual(self.getQueryCount(response), 3)
+
+    def test_sync_views_under_asgi_are_counted(self):
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        sync_response = self.client.get('/rooms/')
+        async_response = async_to_sync(self.async_client.get)('/rooms/')
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertGreater(self.getQueryCount(async_response), 0)
+        self.assertEqual(self.getQueryCount(async_response), self.getQueryCount(sync_response))
+
+    def test_profiler_under_asgi(self):
+        superuser = User.objects.create_superuser('coach')
+        self.async_client.force_login(superuser)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        with override_settings(PROFILER={'DIR': directory.name}):
+            response = async_to_sync(self.async_client.get)('/rooms/?cprofile=1')
+
+        self.assertEqual(response['X-Profiled-Status'], '200')
+        self.assertIn('function calls', response.content.decode())
+        self.assertEqual(os.listdir(directory.name), [response['X-Profile-File']])
+
+
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.client.force_login(self.user)
+        self.profile = Profile.objects.get(user=self.user)
+        self.paths = [f'/profile/{self.user.id}', f'/profile/{self.profile.id}/attendances/']
+
+    def revalidate(self, path, response):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'],
+                               HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def test_unchanged_pages_answer_304(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertIn('private', response['Cache-Control'])
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.revalidate(path, response)
+
+                self.assertEqual(response.status_code, 304)
+                # the session, the viewer and the last_changed markers
+                self.assertEqual(len(queries), 3)
+
+    def test_writes_and_viewers_change_the_etag(self):
+        responses = [self.client.get(path) for path in self.paths]
+        self.client.post('/create-attendance/', {'date': '2026-04-11'})
+        for path, response in zip(self.paths, responses):
+            self.assertEqual(self.revalidate(path, response).status_code, 200)
+
+        responses = [self.client.get(path) for path in self.paths]
+        self.client.post(f'/delete-attendance/{Attendance.objects.get().id}/')
+        for path, response in zip(self.paths, responses):
+            self.assertEqual(self.revalidate(path, response).status_code, 200)
+
+        # the same page seen by someone else has their navbar and no edit links
+        responses = [self.client.get(path) for path in self.paths]
+        self.client.force_login(User.objects.create_user('coach'))
+        for path, response in zip(self.paths, responses):
+            self.assertEqual(self.revalidate(path, response).status_code, 200)
+
+
+class RoomCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.client.force_login(self.user)
+        self.client.post('/create-room/', {'topic': 'Forms', 'name': 'Form review', 'description': ''})
+        self.room = Room.objects.get(name='Form review')
+
+    def test_views_keep_counters_in_step(self):
+        self.client.post(f'/room/{self.room.id}', {'body': 'First'})
+        self.client.post(f'/room/{self.room.id}', {'body': 'Second'})
+        room = Room.objects.get(id=self.room.id)
+        self.assertEqual((room.message_count, room.participant_count), (2, 1))
+        self.assertEqual(room.last_activity, room.message_set.get(body='Second').created)
+
+        self.client.post(f'/delete-message/{room.message_set.get(body="Second").id}/')
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 1)
+        self.assertEqual(room.last_activity, room.message_set.get(body='First').created)
+
+        self.client.post(f'/update-room/{room.id}/', {'topic': 'Sparring', 'name': room.name, 'description': ''})
+        self.assertEqual(Topic.objects.get(name='Forms').room_count, 0)
+        self.assertEqual(Topic.objects.get(name='Sparring').room_count, 1)
+
+        call_command('rebuild_room_counters', check=True, stdout=io.StringIO())
+
+        self.client.post(f'/delete-room/{room.id}/')
+        self.assertEqual(Topic.objects.get(name='Sparring').room_count, 0)
+
+    def test_participant_changes_outside_the_views_are_counted(self):
+        first, second = User.objects.create_user('first'), User.objects.create_user('second')
+        self.room.participants.add(first, second)
+        self.room.participants.add(first)
+        self.assertEqual(Room.objects.get(id=self.room.id).participant_count, 2)
+
+        self.room.participants.remove(first)
+        second.participants.clear()
+        first.participants.add(self.room)
+        self.assertEqual(Room.objects.get(id=self.room.id).participant_count, 1)
+        call_command('rebuild_room_counters', check=True, stdout=io.StringIO())
+
+    def test_rooms_api_revalidates_with_etag(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        first, second = User.objects.create_user('first'), User.objects.create_user('second')
+        self.room.participants.add(first)
+
+        def revalidate(etag):
+            response = client.get('/api/rooms/', HTTP_IF_NONE_MATCH=etag)
+            return response.status_code, response.get('ETag')
+
+        etag = client.get('/api/rooms/')['ETag']
+        self.assertEqual(revalidate(etag), (304, etag))
+
+        # swapping participants keeps the total but must still invalidate
+        self.room.participants.set([second])
+        status, etag = revalidate(etag)
+        self.assertEqual(status, 200)
+        self.assertEqual(client.get('/api/rooms/').json()['results'][0]['participants'], [second.id])
+
+        self.room.participants.remove(second)
+        status, etag = revalidate(etag)
+        self.assertEqual(status, 200)
+
+        self.client.post(f'/room/{self.room.id}', {'body': 'First'})
+        self.assertEqual(revalidate(etag)[0], 200)
+
+    def test_rooms_page_query_count_does_not_grow_with_rooms(self):
+        def countQueries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/rooms/')
+            return len(queries)
+
+        before = countQueries()
+        for i in range(5):
+            self.client.post('/create-room/', {'topic': f'Topic {i}', 'name': f'Room {i}', 'description': ''})
+        self.assertEqual(countQueries(), before)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite allows one writer at a time')
+class ConcurrentCheckInTests(TransactionTestCase):
+    def test_simultaneous_check_ins_record_one_event(self):
+        profile = User.objects.create_user('student').profile
+        dates = [datetime.date(2023, 2, day) for day in range(1, 11)]
+        barrier = threading.Barrier(2)
+
+        def instructor():
+            try:
+                for date in dates:
+                    barrier.wait()
+                    Attendance.check_in(date, [profile.id])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=instructor) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Attendance.objects.count(), len(dates))
+        self.assertEqual(ActivityEvent.objects.filter(kind=ActivityEvent.ATTENDANCE).count(), len(dates))
+
+
+class RoomThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.client.force_login(self.user)
+        self.room = Room.objects.create(host=self.user, name='Sparring')
+        Message.objects.bulk_create([Message(user=self.user, room=self.room, body=f'Message {i}')
+                                     for i in range(views.ROOM_PAGE_SIZE + 5)])
+
+    def test_room_shows_the_newest_page_and_scrolls_back(self):
+        response = self.client.get(f'/room/{self.room.id}')
+        self.assertEqual(response.content.count(b'class="thread"'), views.ROOM_PAGE_SIZE)
+        self.assertContains(response, f'Message {views.ROOM_PAGE_SIZE + 4}')
+        self.assertNotContains(response, 'Message 4<')
+
+        older = self.client.get(f'/room/{self.room.id}/messages/?before={response.context["older_cursor"]}')
+        self.assertEqual(older.content.count(b'class="thread"'), 5)
+        self.assertContains(older, 'Message 0')
+        self.assertNotIn('X-Next-Cursor', older)
+
+    def test_posting_with_fetch_returns_the_message(self):
+        response = self.client.post(f'/room/{self.room.id}', {'body': 'Live'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, 'Live', status_code=201)
+        message = Message.objects.get(body='Live')
+        self.assertContains(response, f'id="message-{message.id}" data-id="{message.id}"', status_code=201)
+
+
+class PollingBrokerTests(TransactionTestCase):
+    # the broker polls from worker threads, which only see committed rows
+
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.room = Room.objects.create(host=self.user, name='Sparring')
+        # explicit ids stand in for two posts committing out of id order
+        Message.objects.create(id=1000, user=self.user, room=self.room, body='Before')
+
+    def receive(self, window):
+        post = sync_to_async(lambda id: Message.objects.create(id=id, user=self.user, room=self.room, body=str(id)))
+
+        async def run():
+            broker = PollingBroker({'POLL_INTERVAL': 0.01, 'REPOLL_WINDOW': window})
+            queue = broker.subscribe(self.room.id, 1000)
+            poller = broker.pollers[self.room.id]
+            # let the poller start before anything is posted
+            await asyncio.sleep(0.2)
+            await post(1010)
+            received = [await asyncio.wait_for(queue.get(), 5)]
+            await asyncio.sleep(0.3)
+            await post(1005)
+            await post(1020)
+            while received[-1][-1][0] != 1020:
+                received.append(await asyncio.wait_for(queue.get(), 5))
+            broker.unsubscribe(self.room.id, queue)
+            await poller
+            return [message_id for batch in received for message_id, html in batch]
+
+        return async_to_sync(run)()
+
+    def test_late_commits_below_the_newest_id_are_delivered(self):
+        self.assertEqual(self.receive(window=60), [1010, 1005, 1020])
+
+    def test_late_commits_outside_the_window_are_given_up(self):
+        self.assertEqual(self.receive(window=0.1), [1010, 1020])
+
+    def test_posts_before_the_first_poll_are_delivered(self):
+        async def run():
+            broker = PollingBroker({'POLL_INTERVAL': 0.2})
+            queue = broker.subscribe(self.room.id, 1000)
+            poller = broker.pollers[self.room.id]
+            # committed after the stream's catch-up, before the poller starts
+            await sync_to_async(Message.objects.create)(id=1010, user=self.user, room=self.room, body='During')
+            batch = await asyncio.wait_for(queue.get(), 5)
+            broker.unsubscribe(self.room.id, queue)
+            await poller
+            return [message_id for message_id, html in batch]
+
+        self.assertEqual(async_to_sync(run)(), [1010])
+
+
+class ActivityEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student')
+        self.client.force_login(self.user)
+        self.room = Room.objects.create(host=self.user, name='Sparring')
+
+    def test_signals_append_chat_and_progress_events(self):
+        self.client.post(f'/room/{self.room.id}', {'body': 'Anyone up for sparring?'})
+        self.client.post('/create-tournament/', {'event': 'Spring Open', 'date': '2026-04-11'})
+        Attendance.check_in(datetime.date(2026, 4, 12), [self.user.profile.id])
+        profile = Profile.objects.get(user=self.user)
+        profile.rank = Profile.RED
+        profile.save()
+
+        self.assertEqual(
+            list(ActivityEvent.objects.values_list('kind', 'actor_username', 'room_name', 'summary')),
+            [(ActivityEvent.PROMOTION, 'student', '', 'Promoted to Red'),
+             (ActivityEvent.ATTENDANCE, 'student', '', 'Checked in for class'),
+             (ActivityEvent.TOURNAMENT, 'student', '', 'Competed in Spring Open'),
+             (ActivityEvent.MESSAGE, 'student', 'Sparring', 'Anyone up for sparring?')],
+        )
+
+        self.room.name = 'Sparring partners'
+        self.room.save()
+        self.assertEqual(ActivityEvent.objects.get(kind=ActivityEvent.MESSAGE).room_name, 'Sparring partners')
+        self.client.post(f'/delete-message/{Message.objects.get().id}/')
+        self.client.post(f'/delete-tournament/{Tournament.objects.get().id}/')
+        self.assertEqual(list(ActivityEvent.objects.values_list('kind', flat=True)),
+                         [ActivityEvent.PROMOTION, ActivityEvent.ATTENDANCE])
+
+    def test_feed_pages_without_joins(self):
+        for i in range(views.ACTIVITY_PAGE_SIZE + 3):
+            Message.objects.create(user=self.user, room=self.room, body=f'Message {i}')
+
+        with CaptureQueriesContext(connection) as queries:
+            events, cursor = views.getActivityPage(ActivityEvent.objects.all())
+        # the page and its actors' avatars, neither joining another table
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('JOIN', queries[0]['sql'])
+        self.assertEqual(events[0].summary, f'Message {views.ACTIVITY_PAGE_SIZE + 2}')
+
+        response = self.client.get(f'/activity/feed/?q=&cursor={cursor}&format=json')
+        self.assertEqual([result['body'] for result in response.json()['results']],
+                         ['Message 2', 'Message 1', 'Message 0'])
+        self.assertIsNone(response.json()['next'])
+
+
+class RosterCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.first = User.objects.create_user('first').profile
+        self.second = User.objects.create_user('second').profile
+
+    def getAttendanceCounts(self):
+        roster = views.getRoster('')
+        return dict(re.findall(r'<span>(\w+)</span>.*?class="progress-value" id="attendance"\s*>(\d+)<', roster, re.S))
+
+    def test_stat_save_invalidates_only_its_card(self):
+        self.assertEqual(self.getAttendanceCounts(), {'first': '0', 'second': '0'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.create(profile=self.first, date=getCurrentPeriod().start)
+        with mock.patch('base.views.render_to_string', wraps=views.render_to_string) as render:
+            self.assertEqual(self.getAttendanceCounts(), {'first': '1', 'second': '0'})
+        self.assertEqual([call.args[1]['profile'].id for call in render.call_args_list], [self.first.id])
+
+    def test_roster_is_served_from_the_cache_until_a_commit(self):
+        self.getAttendanceCounts()
+        # the versions are bumped on commit, so an uncommitted save is not seen
+        Attendance.objects.create(profile=self.first, date=getCurrentPeriod().start)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.getAttendanceCounts(), {'first': '0', 'second': '0'})
+
+
+class ResponseSizeTests(TestCase):
+    ROWS = 20
+
+    def addStudents(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'student{User.objects.count()}')
+            Room.objects.create(host=user, name=f'Sparring with {user.username}')
+        # the roster is cached under versions bumped on commit, which TestCase never does
+        cache.clear()
+
+    def getSizes(self, path):
+        return {encoding: len(self.client.get(path, HTTP_ACCEPT_ENCODING=encoding).content)
+                for encoding in ('identity', 'gzip')}
+
+    def test_bytes_per_row(self):
+        paths = {'/': 1600, '/rooms/': 1000}
+        self.addStudents(self.ROWS)
+        before = {path: self.getSizes(path) for path in paths}
+        self.addStudents(self.ROWS)
+        after = {path: self.getSizes(path) for path in paths}
+
+        for path, limit in paths.items():
+            with self.subTest(path=path):
+                row = {encoding: (after[path][encoding] - before[path][encoding]) / self.ROWS
+                       for encoding in ('identity', 'gzip')}
+                # a room row's icon is a <use> of the sprite, not 1.2kB of inline path data
+                self.assertLess(row['identity'], limit)
+                self.assertLess(row['gzip'], row['identity'] / 4)
+
+        self.assertEqual(self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')['Content-Encoding'], 'gzip')
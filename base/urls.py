@@ -1,37 +1,47 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# under ASGI the read-only pages are served by their async versions
+pages = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('login/', views.loginPage, name="login"),
     path('logout/', views.logoutUser, name="logout"),
     path('register/', views.registerPage, name="register"),
 
-    path('', views.home, name="home"),
+    path('', pages.home, name="home"),
     path('rooms/', views.rooms, name="rooms"),
     path('room/<str:pk>', views.room, name="room"),
-    path('profile/<str:pk>', views.userProfile, name="user-profile"),
+    path('room/<str:pk>/messages/', views.roomMessages, name="room-messages"),
+    path('room/<str:pk>/events/', views.roomEvents, name="room-events"),
+    path('profile/<str:pk>', pages.userProfile, name="user-profile"),
 
     path('create-room/', views.createRoom, name="create-room"),
     path('update-room/<str:pk>/', views.updateRoom, name="update-room"),
     path('delete-room/<str:pk>/', views.deleteRoom, name="delete-room"),
     path('delete-message/<str:pk>/', views.deleteMessage, name="delete-message"),
 
-    path('profile/<str:pk>/attendances/', views.statsPage, name="attendances"),
+    path('export/', views.exportProgress, name="export"),
+    path('profile/<str:pk>/export/', views.exportProgress, name="export-profile"),
+
+    path('profile/<str:pk>/attendances/', pages.statsPage, name="attendances"),
     path('create-attendance/', views.createAttendance, name="create-attendance"),
+    path('bulk-attendance/', views.bulkAttendance, name="bulk-attendance"),
     path('update-attendance/<str:pk>/', views.updateAttendance, name="update-attendance"),
     path('delete-attendance/<str:pk>/', views.deleteAttendance, name="delete-attendance"),
 
-    path('profile/<str:pk>/tournaments/', views.statsPage, name="tournaments"),
+    path('profile/<str:pk>/tournaments/', pages.statsPage, name="tournaments"),
     path('create-tournament/', views.createTournament, name="create-tournament"),
     path('update-tournament/<str:pk>/', views.updateTournament, name="update-tournament"),
     path('delete-tournament/<str:pk>/', views.deleteTournament, name="delete-tournament"),
 
-    path('profile/<str:pk>/leadership-hours/', views.statsPage, name="leadership-hours"),
+    path('profile/<str:pk>/leadership-hours/', pages.statsPage, name="leadership-hours"),
     path('create-leadership-hours/', views.createLeadershipHours, name="create-leadership-hours"),
     path('update-leadership-hours/<str:pk>/', views.updateLeadershipHours, name="update-leadership-hours"),
     path('delete-leadership-hours/<str:pk>/', views.deleteLeadershipHours, name="delete-leadership-hours"),
 
-    path('profile/<str:pk>/practical-scores/', views.statsPage, name="practical-scores"),
+    path('profile/<str:pk>/practical-scores/', pages.statsPage, name="practical-scores"),
     path('create-practical-score/', views.createPracticalScore, name="create-practical-score"),
     path('update-practical-score/<str:pk>/', views.updatePracticalScore, name="update-practical-score"),
     path('delete-practical-score/<str:pk>/', views.deletePracticalScore, name="delete-practical-score"),
@@ -39,5 +49,6 @@ urlpatterns = [
     path('update-user/', views.updateUser, name="update-user"),
 
     path('topics/', views.topicsPage, name="topics"),
-    path('activity/', views.activityPage, name="activity"),
+    path('activity/', pages.activityPage, name="activity"),
+    path('activity/feed/', views.activityFeed, name="activity-feed"),
 ]
\ No newline at end of file
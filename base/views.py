@@ -1,25 +1,136 @@
+import base64
+import json
+
+from django.conf import settings
 from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .caching import FRAGMENT_TIMEOUT, getCachedCards, getRosterKey
+from .forms import RoomForm, UserForm, ProfileForm, AttendanceForm, TournamentForm, LeadershipHoursForm, PracticalScoreForm, \
+    BulkAttendanceForm
+from .export import EXPORT_FORMATS, EXPORT_MODELS, getExportRecords
+from .models import Attendance, Tournament, LeadershipHours, PracticalScore, Message, Room, Topic, Profile, \
+    getCurrentPeriod, getPeriod, getRoomCounts
+from .search import searchActivity, searchProfiles, searchRooms, searchTopics
+
+ACTIVITY_PAGE_SIZE = 20
+ROOM_PAGE_SIZE = 30
+
+def encodeCursor(event):
+    position = [event.created.isoformat(), event.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decodeCursor(cursor):
+    try:
+        created, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse_datetime(created), int(event_id)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def getActivityPage(events, cursor=None, size=ACTIVITY_PAGE_SIZE):
+    """
+    Return one page of activity events newest first and the cursor of the next
+    page. Pages are seeked by (created, id) on the activity_created_idx index
+    instead of OFFSET so every page costs the same however long the feed is.
+    """
+    events = events.order_by('-created', '-id')
+
+    position = decodeCursor(cursor) if cursor else None
+    if position and None not in position:
+        created, event_id = position
+        events = events.filter(Q(created__lt=created) | Q(created=created, id__lt=event_id))
+
+    page = list(events[:size + 1])
+    next_cursor = encodeCursor(page[size - 1]) if len(page) > size else None
+    page = page[:size]
+
+    # the avatars are the one thing not copied into the events; they are
+    # looked up for the page's actors in one query rather than joined
+    profiles = {profile.user_id: profile for profile in
+                Profile.objects.filter(user_id__in={event.actor_id for event in page})
+                .only('user_id', 'picture', 'picture_variants')}
+    for event in page:
+        event.actor_profile = profiles.get(event.actor_id)
+    return page, next_cursor
+
+
+def getRoster(q):
+    period = getCurrentPeriod()
+
+    # the roster reads the same for every visitor, so it is cached whole and
+    # per card, keyed by versions the profile and stat signals bump
+    roster_key = getRosterKey(q, period)
+    roster = cache.get(roster_key)
+    if roster is None:
+        profiles = [profile for profile in searchProfiles(q).select_related('user').with_progress(period)
+                    if profile.name != 'admin']
+        cards = getCachedCards(profiles, period,
+                               lambda profile: render_to_string('base/profile_card.html', {'profile': profile}))
+        roster = ''.join(cards)
+        cache.set(roster_key, roster, FRAGMENT_TIMEOUT)
+    return mark_safe(roster)
+
+
+def getRoomPage(room_id, before=None, size=ROOM_PAGE_SIZE):
+    """
+    Return the newest messages of a room posted before message `before`,
+    oldest first, and the cursor of the page before them.
+    """
+    room_messages = Message.objects.filter(room_id=room_id).select_related('user__profile').order_by('-id')
+    if before is not None:
+        room_messages = room_messages.filter(id__lt=before)
+
+    page = list(room_messages[:size + 1])
+    older_cursor = page[size - 1].id if len(page) > size else None
+    return page[:size][::-1], older_cursor
+
+
+def getProfileConditions(lookup):
+    """
+    The etag_func and last_modified_func of condition() for a page showing
+    the profile whose `lookup` field is the url's pk. Both come from the
+    last_changed markers of that profile and of the viewer's own, whose name
+    and picture are in the navbar, read in one query. The ETag also carries
+    who is looking, since the page shows its owner edit links, and the
+    current period the progress bars count.
+    """
+    def getVersion(request, pk):
+        if not hasattr(request, 'profile_version'):
+            markers = Profile.objects.filter(Q(**{lookup: pk}) | Q(user_id=request.user.id)) \
+                .order_by('id').values_list('id', 'last_changed')
+            period = getCurrentPeriod()
+            request.profile_version = {
+                'etag': f'{request.user.id}-{request.user.is_superuser:d}-{period.start}-{period.end}-' +
+                        '-'.join(f'{profile_id}.{changed.timestamp()}' for profile_id, changed in markers),
+                'last_modified': max((changed for profile_id, changed in markers), default=None),
+            }
+        return request.profile_version
+
+    return {
+        'etag_func': lambda request, pk: getVersion(request, pk)['etag'],
+        'last_modified_func': lambda request, pk: getVersion(request, pk)['last_modified'],
+    }
 
-from .forms import RoomForm, UserForm, ProfileForm, AttendanceForm, TournamentForm, LeadershipHoursForm, PracticalScoreForm
-from .models import Attendance, Tournament, LeadershipHours, PracticalScore, Message, Room, Topic, Profile
 
 def home(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
 
-    profiles = Profile.objects.filter(
-        Q(user__username__icontains=q) |
-        Q(name__icontains=q)
-    ).order_by('name')
-
-    context = {'profiles': profiles}
+    context = {'roster': getRoster(q)}
     return render(request, 'base/home.html', context)
 
 def loginPage(request):
@@ -67,6 +178,10 @@ def registerPage(request):
 
     return render(request, 'base/login_register.html', context)
 
+# revalidated on every visit rather than cached by heuristics, and by the
+# browser only since the pages differ per viewer
+@cache_control(private=True, no_cache=True)
+@condition(**getProfileConditions('user_id'))
 def userProfile(request, pk):
     user = User.objects.get(id=pk)
     profile = user.profile
@@ -112,7 +227,7 @@ def createAttendance(request):
     create_update = "Create"
 
     if request.method == 'POST':
-        Attendance.objects.create(
+        Attendance.objects.get_or_create(
             profile=profile,
             date=request.POST.get('date')
         )
@@ -132,10 +247,14 @@ def updateAttendance(request, pk):
         return HttpResponse('Invalid operation. Users can only edit their own attendances.')
 
     if request.method == 'POST':
-        attendance.date = request.POST.get('date')
-        attendance.save()
-        next = request.POST.get('next', '/')
-        return redirect(next)
+        date = request.POST.get('date')
+        if Attendance.objects.filter(profile=attendance.profile, date=date).exclude(id=attendance.id).exists():
+            messages.error(request, 'An attendance already exists on that date.')
+        else:
+            attendance.date = date
+            attendance.save()
+            next = request.POST.get('next', '/')
+            return redirect(next)
 
     context = {'form': form, 'create_update': create_update}
     return render(request, 'base/stats_form.html', context)
@@ -154,6 +273,25 @@ def deleteAttendance(request, pk):
 
     return render(request, 'base/delete.html', {'obj': attendance})
 
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.is_superuser)
+def bulkAttendance(request):
+    form = BulkAttendanceForm()
+    checked_in = []
+
+    if request.method == 'POST':
+        form = BulkAttendanceForm(request.POST)
+        if form.is_valid():
+            profiles = form.cleaned_data['profiles']
+            summaries = Attendance.check_in(form.cleaned_data['date'], [profile.id for profile in profiles])
+            checked_in = [(profile, summaries[profile.id].attendance_count) for profile in profiles]
+        else:
+            for error in form.errors:
+                messages.error(request, form.errors.get(error))
+
+    context = {'form': form, 'checked_in': checked_in}
+    return render(request, 'base/bulk_attendance_form.html', context)
+
 @login_required(login_url='login')
 def createTournament(request):
     profile = request.user.profile
@@ -313,6 +451,8 @@ def deletePracticalScore(request, pk):
     return render(request, 'base/delete.html', {'obj': practical_score})
 
 @login_required(login_url='login')
+@cache_control(private=True, no_cache=True)
+@condition(**getProfileConditions('id'))
 def statsPage(request, pk):
     profile = Profile.objects.get(id=pk)
     attendances = Attendance.objects.filter(profile=profile)
@@ -330,48 +470,111 @@ def statsPage(request, pk):
 
     return render(request, 'base/stats.html', context)
 
+@login_required(login_url='login')
+def exportProgress(request, pk=None):
+    """
+    Stream a profile's records, or the whole academy's for superusers, as CSV
+    or JSONL. ?period=current or ?period=<date> limits the export to the
+    period containing that date and ?type= to one kind of record.
+    """
+    profile = Profile.objects.get(id=pk) if pk is not None else None
+    if not request.user.is_superuser and (profile is None or profile.user_id != request.user.id):
+        return HttpResponse('Invalid operation. Users can only export their own progress.')
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponse('Invalid operation. Unknown export format.', status=400)
+
+    period = None
+    if request.GET.get('period') == 'current':
+        period = getCurrentPeriod()
+    elif request.GET.get('period'):
+        date = parse_date(request.GET.get('period'))
+        if date is None:
+            return HttpResponse('Invalid operation. The period must be a date (YYYY-MM-DD).', status=400)
+        period = getPeriod(date)
+
+    record_type = request.GET.get('type')
+    if record_type and record_type not in EXPORT_MODELS:
+        return HttpResponse('Invalid operation. Unknown record type.', status=400)
+
+    stream, content_type = EXPORT_FORMATS[fmt]
+    records = getExportRecords(profile, period, [record_type] if record_type else None)
+
+    filename = '-'.join(filter(None, [
+        profile.user.username if profile else 'academy',
+        period.start.isoformat() if period else None,
+        record_type,
+    ]))
+    response = StreamingHttpResponse(stream(records), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
 def rooms(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
 
-    rooms = Room.objects.filter(
-        Q(topic__name__icontains=q) |
-        Q(name__icontains=q) |
-        Q(description__icontains=q) |
-        Q(host__username__icontains=q)
-    )
+    rooms = searchRooms(q).select_related('host__profile', 'topic')
 
-    topics = Topic.objects.all()[0:5]
+    topics = Topic.objects.filter(room_count__gt=0)[0:5]
     room_count_all = Room.objects.all().count()
     room_count = rooms.count()
-    room_messages = Message.objects.filter(
-        Q(room__topic__name__icontains=q) | 
-        Q(room__name__icontains=q) |
-        Q(room__description__icontains=q)
-        )[0:5]
+    activity_events, activity_cursor = getActivityPage(searchActivity(q), size=5)
 
     context = {'rooms': rooms, 'topics': topics,
-               'room_count': room_count, 'room_count_all': room_count_all, 'room_messages': room_messages}
+               'room_count': room_count, 'room_count_all': room_count_all, 'activity_events': activity_events,
+               'activity_cursor': activity_cursor, 'q': q}
     return render(request, 'base/rooms.html', context)
 
 
 def room(request, pk):
-    room = Room.objects.get(id=pk)
-    room_messages = room.message_set.all().order_by('updated', 'created')
-    participants = room.participants.all()
+    room = Room.objects.select_related('host__profile', 'topic').get(id=pk)
     if request.method == 'POST':
-        Message.objects.create(
-            user=request.user,
-            room=room,
-            body=request.POST.get('body')
-        )
-        if not room.participants.contains(request.user):
-            room.participants.add(request.user)
+        with transaction.atomic():
+            message = Message.objects.create(
+                user=request.user,
+                room=room,
+                body=request.POST.get('body')
+            )
+            # get_or_create rather than participants.add() tells whether
+            # this post made the user a participant
+            _, joined = Room.participants.through.objects.get_or_create(room=room, user=request.user)
+            Room.objects.filter(id=room.id).update(
+                message_count=F('message_count') + 1,
+                participant_count=F('participant_count') + int(joined),
+                last_activity=message.created,
+            )
+        # the room's script posts with fetch and appends the message itself
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return render(request, 'base/room_message.html', {'message': message}, status=201)
         return redirect('room', pk=room.id)
 
-    context = {'room': room, 'room_messages': room_messages,
-               'participants': participants}
+    # only the newest messages, older ones load as the thread is scrolled up
+    room_messages, older_cursor = getRoomPage(room.id)
+    participants = room.participants.select_related('profile')
+    # new messages are pushed over server-sent events, which need the ASGI server
+    events_url = reverse('room-events', args=[room.id]) if settings.ASYNC_VIEWS else None
+
+    context = {'room': room, 'room_messages': room_messages, 'older_cursor': older_cursor,
+               'participants': participants, 'events_url': events_url}
     return render(request, 'base/room.html', context)
 
+def roomMessages(request, pk):
+    try:
+        before = int(request.GET.get('before'))
+    except (TypeError, ValueError):
+        return HttpResponse('Invalid operation. Pass the id of the oldest message shown as ?before=.', status=400)
+
+    room_messages, older_cursor = getRoomPage(pk, before)
+    html = render_to_string('base/room_message_list.html', {'room_messages': room_messages}, request=request)
+    response = HttpResponse(html)
+    if older_cursor:
+        response['X-Next-Cursor'] = older_cursor
+    return response
+
+def roomEvents(request, pk):
+    # served by base.events.RoomEvents in front of Django under ASGI
+    return HttpResponse('Invalid operation. Live room updates need the ASGI server.', status=404)
+
 @login_required(login_url='login')
 def createRoom(request):
     form = RoomForm()
@@ -380,14 +583,16 @@ def createRoom(request):
 
     if request.method == 'POST':
         topic_name = request.POST.get('topic')
-        topic, created = Topic.objects.get_or_create(name=topic_name)
-
-        Room.objects.create(
-            host=request.user,
-            topic=topic,
-            name=request.POST.get('name'),
-            description=request.POST.get('description'),
-        )
+        with transaction.atomic():
+            topic, created = Topic.objects.get_or_create(name=topic_name)
+
+            Room.objects.create(
+                host=request.user,
+                topic=topic,
+                name=request.POST.get('name'),
+                description=request.POST.get('description'),
+            )
+            Topic.objects.filter(id=topic.id).update(room_count=F('room_count') + 1)
         return redirect('rooms')
 
     context = {'form': form, 'topics': topics, 'create_update': create_update}
@@ -405,11 +610,15 @@ def updateRoom(request, pk):
 
     if request.method == 'POST':
         topic_name = request.POST.get('topic')
-        topic, created = Topic.objects.get_or_create(name=topic_name)
-        room.name = request.POST.get('name')
-        room.topic = topic
-        room.description = request.POST.get('description')
-        room.save()
+        with transaction.atomic():
+            topic, created = Topic.objects.get_or_create(name=topic_name)
+            if room.topic_id != topic.id:
+                Topic.objects.filter(id=room.topic_id).update(room_count=F('room_count') - 1)
+                Topic.objects.filter(id=topic.id).update(room_count=F('room_count') + 1)
+            room.name = request.POST.get('name')
+            room.topic = topic
+            room.description = request.POST.get('description')
+            room.save()
         return redirect('room', room.id)
 
     context = {'form': form, 'topics': topics,
@@ -424,7 +633,9 @@ def deleteRoom(request, pk):
         return HttpResponse('Invalid operation. Users can only delete rooms they have created.')
 
     if request.method == 'POST':
-        room.delete()
+        with transaction.atomic():
+            room.delete()
+            Topic.objects.filter(id=room.topic_id).update(room_count=F('room_count') - 1)
         return redirect('home')
 
     return render(request, 'base/delete.html', {'obj': room})
@@ -437,7 +648,13 @@ def deleteMessage(request, pk):
         return HttpResponse('Invalid operation. Users can only delete messages they have created.')
 
     if request.method == 'POST':
-        message.delete()
+        with transaction.atomic():
+            message.delete()
+            # the deleted message may have been the newest one
+            Room.objects.filter(id=message.room_id).update(
+                message_count=F('message_count') - 1,
+                last_activity=getRoomCounts()['last_activity'],
+            )
         return redirect('home')
 
     return render(request, 'base/delete.html', {'obj': message})
@@ -445,11 +662,38 @@ def deleteMessage(request, pk):
 def topicsPage(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
 
-    topics = Topic.objects.filter(Q(name__icontains=q))
-    rooms = Room.objects.all()
+    topics = searchTopics(q).filter(room_count__gt=0)
+    room_count_all = Room.objects.all().count()
 
-    return render(request, 'base/topics.html', {'topics': topics, 'rooms': rooms})
+    return render(request, 'base/topics.html', {'topics': topics, 'room_count_all': room_count_all})
 
 def activityPage(request):
-    room_messages = Message.objects.all()
-    return render(request, 'base/activity.html', {'room_messages': room_messages})
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+    activity_events, activity_cursor = getActivityPage(searchActivity(q), request.GET.get('cursor'))
+
+    context = {'activity_events': activity_events, 'activity_cursor': activity_cursor, 'q': q}
+    return render(request, 'base/activity.html', context)
+
+def activityFeed(request):
+    q = request.GET.get('q') if request.GET.get('q') != None else ''
+    activity_events, activity_cursor = getActivityPage(searchActivity(q), request.GET.get('cursor'))
+
+    if request.GET.get('format') == 'json':
+        results = [{
+            'id': event.id,
+            'kind': event.kind,
+            'user': event.actor_username,
+            'user_id': event.actor_id,
+            'picture': event.actor_profile.small_picture.url if event.actor_profile else None,
+            'room': event.room_name or None,
+            'room_id': event.room_id,
+            'body': event.summary,
+            'created': event.created,
+        } for event in activity_events]
+        return JsonResponse({'results': results, 'next': activity_cursor})
+
+    html = render_to_string('base/activity_feed.html', {'activity_events': activity_events}, request=request)
+    response = HttpResponse(html)
+    if activity_cursor:
+        response['X-Next-Cursor'] = activity_cursor
+    return response
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'progress_tracker.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up, since it loads the models
+from base.events import RoomEvents  # noqa: E402
+
+application = RoomEvents(django_application)
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for serving the site under ASGI with uvicorn workers:
+
+    gunicorn -c progress_tracker/gunicorn_asgi.py progress_tracker.asgi:application
+
+The Procfile's plain `gunicorn progress_tracker.wsgi` stays the default.
+"""
+
+import multiprocessing
+import os
+
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    # Django does not implement the ASGI lifespan protocol
+    CONFIG_KWARGS = {**BaseUvicornWorker.CONFIG_KWARGS, 'lifespan': 'off'}
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'progress_tracker.gunicorn_asgi.UvicornWorker'
+
+# one event loop per core is enough, a worker waits on many requests at once.
+# Each worker also keeps a database connection per worker thread the async
+# views run their queries on, so size the database's connection limit for
+# workers * (cores + 4) on top of one per request in flight.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# recycle workers now and then so a slow leak cannot grow unbounded
+max_requests = 1000
+max_requests_jitter = 100
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 
 import dj_database_url
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -58,6 +59,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'base.apps.BaseConfig',
 
@@ -69,25 +71,63 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # compresses every response the middleware below produces; WhiteNoise
+    # answers static files itself, above it
+    'django.middleware.gzip.GZipMiddleware',
+    'base.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'base.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Server-Timing header on every response, and a JSON line on the
+# 'base.requests' logger for requests over any of these limits
+REQUEST_TIMING = {
+    'SLOW_REQUEST_MS': int(os.environ.get('SLOW_REQUEST_MS', 500)),
+    'MAX_QUERIES': 50,
+    'REPEATED_QUERY_THRESHOLD': 10,
+    'SERVER_TIMING_HEADER': True,
+}
+
+# ?cprofile=1 profiles a request for superusers; captures are kept here
+PROFILER = {
+    'DIR': os.environ.get('PROFILER_DIR', os.path.join(BASE_DIR, 'profiles')),
+    'KEEP': 50,
+}
+
+# live room threads under ASGI: 'polling' reads new messages from the
+# database and works across processes, 'local' only sees posts made in the
+# same process, which is enough for a single uvicorn in development
+ROOM_EVENTS = {
+    'BROKER': os.environ.get('ROOM_EVENTS_BROKER', 'polling'),
+    'POLL_INTERVAL': 1.0,
+    # how long the polling broker keeps looking for messages that commit out of id order
+    'REPOLL_WINDOW': 10.0,
+    'KEEPALIVE': 15,
+}
+
 ROOT_URLCONF = 'progress_tracker.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates'
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # parse each template once per process in production; DEBUG
+            # keeps reading them from disk so edits show without a restart
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -100,6 +140,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'progress_tracker.wsgi.application'
 
+# serve the read-only pages with the views in base/async_views.py; asgi.py
+# turns this on, since under WSGI every async view would need its own loop
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '') == 'True'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
@@ -111,6 +155,29 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# cached cards and rosters are invalidated by bumping version counters in the
+# cache, so every worker process has to share it; LocMemCache is per process
+# and only the default while debugging (set it explicitly for a single worker)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache' if DEBUG else '')
+if not CACHE_BACKEND:
+    raise ImproperlyConfigured('Set CACHE_BACKEND to a cache shared by the worker processes, such as '
+                               'django.core.cache.backends.db.DatabaseCache, when DEBUG is off.')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'progress-tracker'),
+    },
+}
+
+if CACHE_BACKEND.endswith(('LocMemCache', 'FileBasedCache', 'DatabaseCache')):
+    # the default of 300 entries is smaller than one roster of cached cards
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
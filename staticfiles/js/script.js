@@ -122,4 +122,110 @@ if (conversationThread) conversationThread.scrollTop = conversationThread.scroll
   animateAll("attendance", 15, 24, "orangered");
   animateAll("tournament", 360, 1, "gold");
   animateAll("hours", 30, 12, "mediumseagreen");
-  animateAll("practical", 3.6, 100, "dodgerblue");
\ No newline at end of file
+  animateAll("practical", 3.6, 100, "dodgerblue");
+
+// Load more activities
+document.querySelectorAll(".activities__more").forEach((button) => {
+  const feed = button.parentElement.querySelector(".activities__feed");
+
+  button.addEventListener("click", (event) => {
+    event.preventDefault();
+    const url = `${button.dataset.feedUrl}&cursor=${button.dataset.cursor}`;
+
+    fetch(url)
+      .then((response) => {
+        const cursor = response.headers.get("X-Next-Cursor");
+        return response.text().then((html) => [html, cursor]);
+      })
+      .then(([html, cursor]) => {
+        feed.insertAdjacentHTML("beforeend", html);
+        if (cursor) button.dataset.cursor = cursor;
+        else button.remove();
+      });
+  });
+});
+
+// Room threads: post without reloading, receive new messages as they are
+// posted, and load older ones when scrolling up
+const threads = document.querySelector(".threads");
+if (threads) {
+  const roomBox = document.querySelector(".room__box");
+  const messageForm = document.querySelector(".room__message form");
+
+  const appendMessage = (html, id) => {
+    if (id && document.getElementById(`message-${id}`)) return;
+    const nearBottom = roomBox.scrollHeight - roomBox.scrollTop - roomBox.clientHeight < 100;
+    threads.insertAdjacentHTML("beforeend", html);
+    if (nearBottom) roomBox.scrollTop = roomBox.scrollHeight;
+  };
+
+  if (messageForm) {
+    messageForm.addEventListener("submit", (event) => {
+      event.preventDefault();
+      const input = messageForm.querySelector("input[name=body]");
+      fetch(window.location.pathname, {
+        method: "POST",
+        body: new FormData(messageForm),
+        headers: { "X-Requested-With": "XMLHttpRequest" },
+      })
+        .then((response) => {
+          // a failed post or a redirect to the login page keeps the text
+          if (!response.ok || response.redirected) throw new Error(`Posting failed with ${response.status}`);
+          return response.text();
+        })
+        .then((html) => {
+          input.value = "";
+          const template = document.createElement("template");
+          template.innerHTML = html.trim();
+          const id = template.content.firstElementChild.dataset.id;
+          // the stream may have delivered it first, without the delete link
+          const streamed = document.getElementById(`message-${id}`);
+          if (streamed) streamed.outerHTML = html;
+          else appendMessage(html, id);
+          roomBox.scrollTop = roomBox.scrollHeight;
+        })
+        .catch(() => {
+          // post the form normally so the server's error or login page shows
+          messageForm.submit();
+        });
+    });
+  }
+
+  if (threads.dataset.eventsUrl) {
+    const newest = threads.querySelector(".thread:last-of-type");
+    const after = newest ? newest.id.replace("message-", "") : "";
+    const events = new EventSource(`${threads.dataset.eventsUrl}?after=${after}`);
+    events.addEventListener("message", (event) => appendMessage(event.data, event.lastEventId));
+  }
+
+  const older = threads.querySelector(".threads__older");
+  if (older) {
+    let loading = false;
+    const loadOlder = () => {
+      if (loading) return;
+      loading = true;
+      fetch(`${threads.dataset.messagesUrl}?before=${older.dataset.cursor}`)
+        .then((response) => {
+          const cursor = response.headers.get("X-Next-Cursor");
+          return response.text().then((html) => [html, cursor]);
+        })
+        .then(([html, cursor]) => {
+          // keep the messages on screen where they are
+          const height = roomBox.scrollHeight;
+          older.insertAdjacentHTML("afterend", html);
+          roomBox.scrollTop += roomBox.scrollHeight - height;
+          if (cursor) older.dataset.cursor = cursor;
+          else older.remove();
+          loading = false;
+        });
+    };
+
+    older.addEventListener("click", (event) => {
+      event.preventDefault();
+      loadOlder();
+    });
+    new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadOlder();
+    }, { root: roomBox }).observe(older);
+  }
+}